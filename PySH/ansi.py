@@ -1,9 +1,10 @@
-from string import Template
-
 """
 This module defines the ANSI terminal codes and support functions
 """
 
+import functools
+import re
+
 # CODES:
 ESC                   = chr(27)
 RESET                 = ESC + '[0m'
@@ -58,15 +59,64 @@ for k, v in globals().copy().items():
 
 current_locals = locals().copy()
 ANSI_MAP = dict([(x, current_locals[x])
-  for x in current_locals if x[0] != '_']) #: Map of codenames to codes
+  for x in current_locals if x[0] != '_' and isinstance(current_locals[x], str)]) #: Map of codenames to codes
 
 DEFAULT_MAP = dict([(x, '')
   for x in ANSI_MAP.keys()]) #: Map of codenames to empty strings
 
+PROMPT_MAP = dict([(x, ANSI_MAP['PROMPT_{}'.format(x)])
+  for x in ANSI_MAP if 'PROMPT_{}'.format(x) in ANSI_MAP]) #: Map of codenames to readline-safe codes
+
 
 del current_locals
 
 
+# same placeholders as string.Template: $$, $name and ${name}
+_placeholder_re = re.compile(r'\$(?:(\$)|([_a-zA-Z][_a-zA-Z0-9]*)|\{([_a-zA-Z][_a-zA-Z0-9]*)\})')
+
+
+class Compiled_Template:
+  """
+  A template split once into literal text and code names. The renderings
+  for ANSI_MAP and DEFAULT_MAP are computed up front.
+  """
+
+  __slots__ = ('chunks', 'tail', 'ansi', 'plain')
+
+  def __init__(self, s):
+    self.chunks = [] #: (literal, codename, placeholder text)
+    pos = 0
+    for m in _placeholder_re.finditer(s):
+      dollar, name, braced = m.groups()
+      if dollar:
+        self.chunks.append((s[pos:m.start()] + '$', None, ''))
+      else:
+        self.chunks.append((s[pos:m.start()], name or braced, m.group(0)))
+      pos = m.end()
+    self.tail = s[pos:]
+    self.ansi = self.render(ANSI_MAP)
+    self.plain = self.render(DEFAULT_MAP)
+
+  def render(self, map):
+    parts = []
+    for literal, name, text in self.chunks:
+      parts.append(literal)
+      if name is not None:
+        parts.append(map.get(name, text))
+    parts.append(self.tail)
+    return ''.join(parts)
+
+  def substitute(self, map = DEFAULT_MAP):
+    if map is DEFAULT_MAP:
+      return self.plain
+    if map is ANSI_MAP:
+      return self.ansi
+    return self.render(map)
+
+
+compile_template = functools.lru_cache(maxsize=512)(Compiled_Template)
+
+
 def map_string(s, map = DEFAULT_MAP):
   """
   Coverts a templatized string to a string with the template parameters
@@ -86,8 +136,15 @@ def map_string(s, map = DEFAULT_MAP):
            map
   """
 
-  t = Template(s)
-  return t.safe_substitute(map)
+  return compile_template(s).substitute(map)
+
+
+def strip_markup(s):
+  """
+  Removes the template markup, for output that is not a terminal.
+  """
+
+  return compile_template(s).plain
 
 
 if __name__ == '__main__':
@@ -123,3 +180,17 @@ if __name__ == '__main__':
   for s in strings:
     print(map_string(s, ANSI_MAP))
 
+  import string
+  import unittest
+
+  class TestCase(unittest.TestCase):
+    def test_same_as_template(self):
+      for s in strings + ['$$RED ${RED}x$RED y $NOPE ${NOPE} $ ${ RED} $1', '', 'plain']:
+        for m in (ANSI_MAP, DEFAULT_MAP, {'RED': '<r>'}):
+          self.assertEqual(map_string(s, m), string.Template(s).safe_substitute(m))
+
+    def test_strip(self):
+      self.assertEqual(strip_markup('${RED}red${RESET} $$5'), 'red $5')
+
+  unittest.main()
+
@@ -1,17 +1,37 @@
+from .cmdhash import find_command, forget, hashed
 from .job import find_job, jobs
-from .proc import Process
+from .proc import Thread_Process, exit_status, flush_output
+from .term import Terminal
 
+import _thread
 import os
 import sys
+import time
 
 
+_terminal = Terminal()
+_running = _thread._local() # .jobs: of the builtins running on this thread, innermost last
+
 _flags = {}
 _flags['tracebacks'] = False
+_flags['notify'] = False
+_flags['profile'] = False
 _lastdir = os.getcwd()
 _pushdirs = []
+_cwd_hooks = [] # called after cd, see prompt.install()
+
+
+class Exit(EOFError):
+    """Raised by exit, leaves the shell (or the subshell it runs in) with status."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
 
 
 def builtin_cd(argv): 
+    global _lastdir
+
     if argv[0] == 'popd':
         goto = _pushdirs[-1]
     elif len(argv) == 1:
@@ -25,10 +45,21 @@ def builtin_cd(argv):
     ld = os.getcwd()
     os.chdir(os.path.expanduser(goto))
     _lastdir = ld
+    for hook in _cwd_hooks:
+        hook()
     return 0
 
 def builtin_exit(argv):
-    raise EOFError
+    if len(argv) > 2:
+        raise RuntimeError('required usage: exit [n]')
+    if len(argv) == 1:
+        from .cmd import _last_status
+        raise Exit(_last_status)
+    try:
+        status = int(argv[1])
+    except ValueError:
+        raise RuntimeError('required usage: exit [n]')
+    raise Exit(status & 0xff)
 
 def builtin_bg(argv):
     if len(argv) == 1:
@@ -55,10 +86,19 @@ def builtin_fg(argv):
     return 0
 
 def builtin_jobs(argv):
+    if len(argv) > 2 or argv[1:] not in ([], ['-l'], ['-j']):
+        raise RuntimeError('required usage: jobs [-l|-j]')
+    as_json = argv[1:] == ['-j']
+    if as_json:
+        import json
+    running = _running_jobs()
     for job in jobs():
-        if job.next is None: # ignore the jobs command
-            break
-        job.print_info()
+        if any(job is x for x in running): # this command and, with time, its caller
+            continue
+        if as_json:
+            print(json.dumps(job.usage()))
+        else:
+            job.print_info(file=sys.stdout, usage=(argv[1:] == ['-l']))
     return 0
 
 def builtin_pushd(argv):
@@ -82,30 +122,283 @@ def builtin_set(argv):
     if argv[2] not in _flags:
         raise RuntimeError('{} not a valid flag'.format(argv[2]))
     _flags[argv[2]] = (argv[1] == 'enable')
+    if argv[2] == 'profile':
+        from . import perf
+        if _flags['profile']:
+            perf.enable()
+        else:
+            perf.disable()
     return 0
 
+def builtin_prompt(argv):
+    from . import prompt
 
-class Builtin_Process(Process):
-    __slots__ = ('argv', 'pid', 'completed', 'stopped', 'status', 'term_signal')
+    if len(argv) == 1:
+        print(prompt.get_template())
+    elif len(argv) == 2:
+        prompt.set_template(argv[1])
+    else:
+        raise RuntimeError('required usage: prompt [template]')
+    return 0
+
+def builtin_globstar(argv):
+    from . import pathglob
 
-    def __init__(self, argv):
-        super().__init__(argv)
+    usage = 'required usage: globstar [-j threads] [-n max]'
+    if len(argv) == 1:
+        print('threads {} max {}'.format(pathglob.GLOBSTAR_THREADS, pathglob.GLOBSTAR_MAX or 'unlimited'))
+        return 0
+    if len(argv) % 2 == 0:
+        raise RuntimeError(usage)
+    for opt, value in zip(argv[1::2], argv[2::2]):
+        if opt not in ('-j', '-n') or not value.isdigit():
+            raise RuntimeError(usage)
+        if opt == '-j':
+            pathglob.GLOBSTAR_THREADS = max(1, int(value))
+        else:
+            pathglob.GLOBSTAR_MAX = int(value)
+    return 0
 
-    def launch(self, pgid, infile, outfile, errfile, fg, subshell=False):
-        builtinname = 'builtin_{}'.format(self.argv[0])
-        func = globals().get(builtinname)
+def builtin_pyimport(argv):
+    from . import pycmd
 
-        if not subshell:
-            try:
-                func(self.argv)
-            except Exception as e:
-                print('pysh: {}: {}'.format(self.argv[0], str(e)), file=sys.stderr)
-                self.mark_status(1)
-            else:
-                self.mark_status(0)
+    if len(argv) == 1:
+        for name in pycmd.commands():
+            print(name)
+        return 0
+    for target in argv[1:]:
+        pycmd.load(target)
+    return 0
+
+def builtin_pipesize(argv):
+    from . import pipeio
+
+    if len(argv) == 1:
+        print(pipeio.PIPE_SIZE or 'default')
+    elif len(argv) == 2:
+        pipeio.PIPE_SIZE = pipeio.parse_size(argv[1])
+    else:
+        raise RuntimeError('required usage: pipesize [bytes[K|M]]')
+    return 0
+
+def builtin_parallel(argv):
+    from .parallel import make_commands, run_parallel
+
+    usage = 'required usage: parallel [-j jobs] [-n args] [-k] command [arg ...] [::: item ...]'
+    max_jobs = None
+    per_command = 1
+    keep_order = False
+    args = argv[1:]
+    while args and args[0] in ('-j', '-n', '-k'):
+        opt = args.pop(0)
+        if opt == '-k':
+            keep_order = True
+            continue
+        if not args or not args[0].isdigit() or int(args[0]) == 0:
+            raise RuntimeError(usage)
+        if opt == '-j':
+            max_jobs = int(args.pop(0))
         else:
-            super().launch(pgid, infile, outfile, errfile, fg)
+            per_command = int(args.pop(0))
+    if ':::' in args:
+        sep = args.index(':::')
+        args, items = args[:sep], args[sep + 1:]
+    else:
+        items = (line.rstrip('\n') for line in sys.stdin if line.strip())
+    if not args:
+        raise RuntimeError(usage)
 
-    def _launch(self):
-        sys.exit(func(self.argv))
+    start = time.monotonic()
+    results = run_parallel(make_commands(args, items, per_command), max_jobs, keep_order)
+    failed = sum(1 for r in results if r.returncode != 0)
+    print('parallel: {} jobs, {} failed, {:.2f}s elapsed, {:.2f}s total, {:.2f}s cpu'.format(
+        len(results), failed, time.monotonic() - start, sum(r.elapsed for r in results),
+        sum(r.cpu for r in results)), file=sys.stderr)
+    return 1 if failed else 0
+
+def builtin_time(argv):
+    from .job import Job, add_job, format_usage, remove_job
+    from .proc_factory import create_proc
+
+    as_json = argv[1:2] == ['-j']
+    args = argv[2:] if as_json else argv[1:]
+    if not args:
+        if as_json:
+            raise RuntimeError('required usage: time [-j] [command [arg ...]]')
+        # the totals for all the shell's children so far
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        print('user {:.3f}s sys {:.3f}s'.format(usage.ru_utime, usage.ru_stime), file=sys.stderr)
+        return 0
+
+    job = Job(' '.join(args))
+    job.add_proc(create_proc(args))
+    add_job(job)
+    job.launch()
+    if not job.completed: # stopped, it stays in the job table
+        return job.returncode
+    remove_job(job)
+    if as_json:
+        import json
+        print(json.dumps(job.usage()), file=sys.stderr)
+    else:
+        print(format_usage(job), file=sys.stderr)
+    return job.returncode
 
+def builtin_stats(argv):
+    from . import perf
+
+    usage = 'required usage: stats [-r | -j file | -t file]'
+    if len(argv) == 1:
+        if not perf.enabled():
+            print('stats: profiling is off, see set enable profile')
+            return 0
+        perf.report(sys.stdout)
+    elif argv[1:] == ['-r']:
+        perf.clear()
+    elif len(argv) == 3 and argv[1] in ('-j', '-t'):
+        with open(os.path.expanduser(argv[2]), 'w') as f:
+            if argv[1] == '-j':
+                perf.export_json(f)
+            else:
+                perf.export_chrome(f)
+    else:
+        raise RuntimeError(usage)
+    return 0
+
+def builtin_history(argv):
+    from .history import History, format_entry
+
+    usage = 'required usage: history [count] | history search [-n count] text | history compact'
+    history = History()
+    if len(argv) == 1 or (len(argv) == 2 and argv[1].isdigit()):
+        entries = history.tail(int(argv[1]) if len(argv) == 2 else len(history))
+    elif argv[1:] == ['compact']:
+        history.compact()
+        return 0
+    elif len(argv) == 3 and argv[1] == 'search':
+        entries = history.search(argv[2])
+    elif len(argv) == 5 and argv[1] == 'search' and argv[2] == '-n' and argv[3].isdigit():
+        entries = history.search(argv[4], limit=int(argv[3]))
+    else:
+        raise RuntimeError(usage)
+    for entry in entries:
+        print(format_entry(*entry))
+    return 0 if entries or argv[1:2] != ['search'] else 1
+
+def builtin_parsecache(argv):
+    from .cmd import clear_parse_cache, parse_cache_info
+
+    if len(argv) == 2 and argv[1] == '-r':
+        clear_parse_cache()
+        return 0
+    if len(argv) != 1:
+        raise RuntimeError('required usage: parsecache [-r]')
+    info = parse_cache_info()
+    lookups = info.hits + info.misses
+    print('hits {} misses {} ({:.0%} hit rate), {}/{} lines cached'.format(
+        info.hits, info.misses, info.hits / lookups if lookups else 0, info.currsize, info.maxsize))
+    return 0
+
+def builtin_hash(argv):
+    if len(argv) == 1:
+        table = hashed()
+        if not table:
+            print('hash: hash table empty')
+            return 0
+        print('hits\tcommand')
+        for name, path, hits in table:
+            print('{:4}\t{}'.format(hits, path))
+        return 0
+    if argv[1] == '-r':
+        forget()
+        return 0
+    status = 0
+    for name in argv[1:]:
+        if name in BUILTINS:
+            continue
+        forget(name)
+        if find_command(name) is None:
+            print('pysh: hash: {}: not found'.format(name), file=sys.stderr)
+            status = 1
+    return status
+
+
+BUILTINS = dict((name[len('builtin_'):], func)
+  for name, func in globals().items() if name.startswith('builtin_'))
+
+# builtins that change the shell's own state; in a pipeline they run in a
+# forked subshell, like in sh, rather than on a thread of the shell itself.
+# parallel and time reap children, which only the main thread may do
+_FORK_IN_PIPELINE = frozenset((
+    'cd', 'pushd', 'popd', 'exit', 'fg', 'bg', 'set', 'prompt', 'globstar', 'pyimport',
+    'pipesize', 'parallel', 'time'))
+
+
+def _running_jobs():
+    try:
+        return _running.jobs
+    except AttributeError:
+        _running.jobs = []
+        return _running.jobs
+
+def _run_builtin(argv):
+    try:
+        return BUILTINS[argv[0]](argv) or 0
+    except EOFError:
+        raise
+    except Exception as e:
+        print('pysh: {}: {}'.format(argv[0], str(e)), file=sys.stderr)
+        return 1
+
+
+class Builtin_Process(Thread_Process):
+    """
+    A builtin runs in the shell itself when it is a command of its own,
+    with its redirections applied to sys.stdin/stdout/stderr. As a pipeline
+    stage it runs on a worker thread with the pipe fds, so 'jobs | grep
+    Running' needs no fork and sees the shell's job table.
+    """
+
+    __slots__ = ()
+
+    def launch(self, pgid, fds, fg):
+        job = self.job
+        if len(job.procs) > 1:
+            if self.argv[0] in _FORK_IN_PIPELINE:
+                return self._fork(pgid, fds, fg)
+            return super().launch(pgid, fds, fg)
+
+        running = _running_jobs()
+        running.append(job)
+        try:
+            if fds == {0: job.stdin, 1: job.stdout, 2: job.stderr}:
+                self.mark_status(exit_status(_run_builtin(self.argv)))
+            else:
+                self.mark_status(self._run_redirected(*self._dup_fds(fds)))
+        finally:
+            running.pop()
+            flush_output()
+        return None
+
+    def _run(self):
+        running = _running_jobs()
+        running.append(self.job)
+        try:
+            return BUILTINS[self.argv[0]](self.argv)
+        finally:
+            running.pop()
+
+    def _launch(self):
+        # in a forked subshell, where exit only leaves the subshell; sys.stdin
+        # may hold input the shell read ahead from its own stdin. The jobs
+        # that time and parallel start are part of this stage, not jobs of
+        # their own
+        _terminal.disable_job_control()
+        sys.stdin = open(0, 'r', errors='surrogateescape', closefd=False)
+        try:
+            return _run_builtin(self.argv)
+        except Exit as e:
+            return e.status
+        except EOFError:
+            return 0
@@ -1,69 +1,351 @@
+from . import perf
 from .job import *
+from .parser import Literal_Word, Quoted_Word, parse
+from .pathglob import Glob_Limit_Error, brace_expand, escape, glob, has_magic
+from .proc import Process
 from .proc_factory import create_proc
+from .term import Terminal
 
-import glob
+import functools
 import os
-import string
-import subprocess
+import re
+import sys
 
 
+_terminal = Terminal()
+
+_var_pattern = r'\$(?:([A-Za-z_]\w*|\d)|\{([^}]*)\}|([?#$]))'
+_var_re = re.compile(_var_pattern)
+# inside double quotes a backslash only escapes $ ` " \ and newline
+_dq_re = re.compile(r'\\([$`"\\\n])|' + _var_pattern)
+# the pieces of a word with quotes: 'sq', "dq", \c and unquoted text
+_segment_re = re.compile(r''''([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)|([^'"\\]+)''', re.DOTALL)
+_positional = ['pysh'] # $0, $1, ...
+_last_status = 0
+
+PARSE_CACHE_SIZE = 512
+
+# command lines parse to the same unexpanded AST every time, only the
+# expansion in make_job depends on the environment and the filesystem
+_cached_parse = functools.lru_cache(maxsize=PARSE_CACHE_SIZE)(parse)
+
+
+class Expansion_Error(Exception):
+    pass
+
+
+def _glob(pattern):
+    with perf.span('glob'):
+        return glob(pattern)
+
 def shellglob(x):
-    result = glob.glob(x)
-    if len(result) == 0:
+    if not has_magic(x):
         return [x]
-    return result
+    return _glob(x) or [x]
 
 def parse_command(cmdline):
-    cmd = Command()
-    cmd._parse(cmdline)
-    return cmd
-
-
-class Command:
-    def __init__(self):
-        self.__fg = True
-
-    def _parse(self, cmd):
-        state = None
-        self.__parts = []
-        token = []
-        cmdline = []
-        
-        for i, c in enumerate(cmd):
-            if state is None:
-                if c in string.whitespace:
-                    tok = shellglob(''.join(token))
-                    for tok in shellglob(''.join(token)):
-                        self.__parts.append(tok)
-                        cmdline.extend(tok)
-                        cmdline.append(c)
-                    del token[:]
-                    continue
-                elif c in ('"', "'"):
-                    state = c
-                    continue
-                elif c == '&':
-                    self.__fg = False
-                    break
-            elif state in ('"', "'"):
-                if c == state:
-                    state = None
-                    continue
-
-            token.append(c)
-
-        if token:
-            for tok in shellglob(''.join(token)):
-                self.__parts.append(tok)
-                cmdline.extend(tok)
-                cmdline.append(' ')
-        self.__cmdline = ''.join(cmdline)
+    with perf.span('parse'):
+        return Command_List(_cached_parse(cmdline))
 
-    def run(self):
-        if len(self.__parts):
-            proc = create_proc(self.__parts)
-            job = Job(self.__cmdline)
+def parse_cache_info():
+    return _cached_parse.cache_info()
+
+def clear_parse_cache():
+    _cached_parse.cache_clear()
+
+def set_positional(args):
+    _positional[:] = args
+
+def _lookup(m, offset=0):
+    name = m.group(offset + 1) or m.group(offset + 2) or m.group(offset + 3)
+    if name.isdigit():
+        idx = int(name)
+        return _positional[idx] if idx < len(_positional) else ''
+    if name == '?':
+        return str(_last_status)
+    if name == '#':
+        return str(len(_positional) - 1)
+    if name == '$':
+        return str(os.getpid())
+    # like os.path.expandvars, unknown variables are left alone
+    return os.environ.get(name, m.group(0))
+
+def _expand_dq(text):
+    if '$' not in text and '\\' not in text:
+        return text
+    return _dq_re.sub(lambda m: _lookup(m, 1) if m.group(1) is None else
+                      '' if m.group(1) == '\n' else m.group(1), text)
+
+def _expand_quoted(word):
+    # quotes are removed piece by piece; quoted pieces are never split and
+    # are escaped for glob, so only the unquoted ones can match files. The
+    # result of an unquoted expansion is split, so one word can give
+    # several fields, and a field is kept when empty only if it had quotes
+    fields = []
+    text = []
+    pattern = []
+    magic = False
+    quoted = False
+
+    def end_field():
+        nonlocal text, pattern, magic, quoted
+        if text or quoted:
+            fields.append((''.join(text), ''.join(pattern), magic))
+        text, pattern, magic, quoted = [], [], False, False
+
+    for m in _segment_re.finditer(word):
+        sq, dq, escaped, plain = m.groups()
+        if plain is not None:
+            value = _var_re.sub(_lookup, plain) if '$' in plain else plain
+            parts = value.split() if value != plain else [value]
+            if value[:1].isspace():
+                end_field()
+            for i, part in enumerate(parts):
+                if i:
+                    end_field()
+                text.append(part)
+                pattern.append(part)
+                magic = magic or has_magic(part)
+            if value[-1:].isspace():
+                end_field()
+            continue
+        if sq is not None:
+            value = sq
+        elif dq is not None:
+            value = _expand_dq(dq)
+        elif escaped != '\n':
+            value = escaped
+        else:
+            continue
+        text.append(value)
+        pattern.append(escape(value))
+        quoted = True
+    end_field()
+
+    result = []
+    for text, pattern, magic in fields:
+        result.extend(magic and _glob(pattern) or [text])
+    return result
+
+def _expand_unquoted(word):
+    if '"' in word or "'" in word or '\\' in word:
+        return _expand_quoted(word)
+    value = _var_re.sub(_lookup, word) if '$' in word else word
+    # only the results of an expansion are split into fields
+    fields = value.split() if value != word else [word]
+    result = []
+    for field in fields:
+        result.extend(shellglob(field))
+    return result
+
+def expand_word(word):
+    if isinstance(word, Literal_Word):
+        return [str(word)]
+    if isinstance(word, Quoted_Word):
+        return [_expand_dq(word)]
+    if '{' not in word:
+        return _expand_unquoted(word)
+    result = []
+    for w in brace_expand(word):
+        result.extend(_expand_unquoted(w))
+    return result
+
+def expand_command(cmd):
+    argv = []
+    for word in [cmd.name] + cmd.args:
+        argv.extend(expand_word(word))
+    return argv
+
+def pipeline_text(pipeline):
+    return ' | '.join(' '.join([cmd.name] + cmd.args) for cmd in pipeline.cmds)
+
+def and_or_text(and_or):
+    parts = [pipeline_text(and_or.pipelines[0])]
+    for op, pipeline in zip(and_or.ops, and_or.pipelines[1:]):
+        parts.extend((op, pipeline_text(pipeline)))
+    return ' '.join(parts)
+
+def expand_redirects(cmd):
+    redirects = []
+    for redirect in cmd.redirects:
+        words = expand_word(redirect.filename)
+        if len(words) != 1:
+            raise Expansion_Error('{}: ambiguous redirect'.format(redirect.filename))
+        target = words[0]
+        if redirect.type == '>&' and redirect.fd != 1 and target != '-' and not target.isdigit():
+            # >&file is stdout and stderr both, there is no N>&file
+            raise Expansion_Error('{}: ambiguous redirect'.format(target))
+        redirects.append((redirect.fd, redirect.type, target))
+    return redirects
+
+def make_job(pipeline):
+    stages = []
+    with perf.span('expand'):
+        for cmd in pipeline.cmds:
+            argv = expand_command(cmd)
+            if argv:
+                stages.append((argv, expand_redirects(cmd)))
+    job = Job(' | '.join(' '.join(argv) for argv, redirects in stages))
+    with perf.span('create_proc'):
+        for argv, redirects in stages:
+            proc = create_proc(argv)
+            proc.redirects = redirects
             job.add_proc(proc)
-            add_job(job)
-            job.launch(fg=self.__fg)
+    return job
+
+def run_pipeline(pipeline, fg=True):
+    global _last_status
+
+    try:
+        job = make_job(pipeline)
+    except (Expansion_Error, Glob_Limit_Error) as e:
+        print('pysh: {}'.format(e), file=sys.stderr)
+        _last_status = 1
+        return _last_status
+    add_job(job)
+    job.launch(fg=fg)
+    _last_status = job.returncode if fg else 0
+    return _last_status
+
+def run_and_or(and_or):
+    status = run_pipeline(and_or.pipelines[0])
+    for op, pipeline in zip(and_or.ops, and_or.pipelines[1:]):
+        if (op == '&&') == (status == 0):
+            status = run_pipeline(pipeline)
+    return status
+
+
+class Command_List:
+    def __init__(self, complete_command):
+        self.__cmdlist = complete_command.cmdlist
+
+    def run(self):
+        status = 0
+        for and_or in self.__cmdlist:
+            if not and_or.background:
+                status = run_and_or(and_or)
+            elif len(and_or.pipelines) == 1:
+                status = run_pipeline(and_or.pipelines[0], fg=False)
+            else:
+                job = Job(and_or_text(and_or))
+                job.add_proc(Subshell_Process(and_or))
+                add_job(job)
+                job.launch(fg=False)
+                status = 0
+        return status
+
+
+class Subshell_Process(Process):
+    __slots__ = ('and_or',)
+
+    needs_fork = True
+
+    def __init__(self, and_or):
+        super().__init__(['pysh'])
+        self.and_or = and_or
+
+    def _launch(self):
+        _terminal.disable_job_control()
+        return run_and_or(self.and_or)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.cwd = os.getcwd()
+            os.chdir(self.tmp.name)
+            for name in ('a1', 'a2', 'b1'):
+                open(name, 'w').close()
+            os.environ['PYSH_TEST'] = 'x  y'
+            set_positional(['script', 'one two', 'three'])
+
+        def tearDown(self):
+            del os.environ['PYSH_TEST']
+            set_positional(['pysh'])
+            os.chdir(self.cwd)
+            self.tmp.cleanup()
+
+        def argv(self, cmdline):
+            return expand_command(parse(cmdline).cmdlist[0].pipelines[0].cmds[0])
+
+        def test_quotes(self):
+            self.assertEqual(self.argv("echo 'a  b' \"c  d\" e\\ f"), ['echo', 'a  b', 'c  d', 'e f'])
+            self.assertEqual(self.argv("echo a'b c'\"d\"e"), ['echo', 'ab cde'])
+            self.assertEqual(self.argv("echo '$PYSH_TEST' \\$PYSH_TEST"), ['echo', '$PYSH_TEST', '$PYSH_TEST'])
+            self.assertEqual(self.argv('echo "a\\$b \\"c\\" \\\\ \\x"'), ['echo', 'a$b "c" \\ \\x'])
+            self.assertEqual(self.argv("echo ''"), ['echo', ''])
+
+        def test_variables(self):
+            global _last_status
+
+            self.assertEqual(self.argv('echo $PYSH_TEST'), ['echo', 'x', 'y'])
+            self.assertEqual(self.argv('echo "$PYSH_TEST"'), ['echo', 'x  y'])
+            self.assertEqual(self.argv('echo ${PYSH_TEST}z'), ['echo', 'x', 'yz'])
+            self.assertEqual(self.argv('echo "${PYSH_TEST}"z'), ['echo', 'x  yz'])
+            # in a word with quotes only the unquoted expansion is split
+            self.assertEqual(self.argv('echo a"b c"$PYSH_TEST'), ['echo', 'ab cx', 'y'])
+            self.assertEqual(self.argv("echo $PYSH_TEST'q r'"), ['echo', 'x', 'yq r'])
+            self.assertEqual(self.argv('echo "<"$PYSH_TEST">"'), ['echo', '<x', 'y>'])
+            # unknown variables are left alone, like os.path.expandvars
+            self.assertEqual(self.argv('echo $PYSH_UNSET_VAR'), ['echo', '$PYSH_UNSET_VAR'])
+            saved = _last_status
+            _last_status = 3
+            try:
+                self.assertEqual(self.argv('echo $? "$?"'), ['echo', '3', '3'])
+            finally:
+                _last_status = saved
+            self.assertEqual(self.argv('echo $$'), ['echo', str(os.getpid())])
+
+        def test_positional(self):
+            self.assertEqual(self.argv('echo $0 $#'), ['echo', 'script', '2'])
+            self.assertEqual(self.argv('echo $1'), ['echo', 'one', 'two'])
+            self.assertEqual(self.argv('echo "$1" "$2"'), ['echo', 'one two', 'three'])
+            # an empty expansion leaves no field unless it is quoted
+            self.assertEqual(self.argv('echo $5'), ['echo'])
+            self.assertEqual(self.argv('echo ""$5 a$5"" $5\\ '), ['echo', '', 'a', ' '])
+            self.assertEqual(self.argv('echo "$5"'), ['echo', ''])
+
+        def test_globs(self):
+            self.assertEqual(self.argv('echo a*'), ['echo', 'a1', 'a2'])
+            self.assertEqual(self.argv("echo 'a*' a\\* \"a*\""), ['echo', 'a*', 'a*', 'a*'])
+            self.assertEqual(self.argv('echo "a"?'), ['echo', 'a1', 'a2'])
+            self.assertEqual(self.argv('echo z*'), ['echo', 'z*'])
+            self.assertEqual(self.argv('echo {a,b}1'), ['echo', 'a1', 'b1'])
+            # the result of an expansion is split, then globbed
+            os.environ['PYSH_TEST'] = 'b* a2'
+            self.assertEqual(self.argv('echo $PYSH_TEST'), ['echo', 'b1', 'a2'])
+            self.assertEqual(self.argv('echo "$PYSH_TEST"'), ['echo', 'b* a2'])
+
+        def test_parse_cache(self):
+            import contextlib
+            import io
+            from . import cmd # the module the builtins use, not __main__
+            from .builtins import BUILTINS
+
+            def cached_argv(cmdline):
+                return cmd.expand_command(cmd._cached_parse(cmdline).cmdlist[0].pipelines[0].cmds[0])
+
+            cmd.clear_parse_cache()
+            cmdline = 'echo $PYSH_TEST a*'
+            self.assertEqual(cached_argv(cmdline), ['echo', 'x', 'y', 'a1', 'a2'])
+            # a hit returns the same AST, expanded again
+            os.environ['PYSH_TEST'] = 'z'
+            open('a3', 'w').close()
+            st = os.stat('.')
+            os.utime('.', ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            self.assertEqual(cached_argv(cmdline), ['echo', 'z', 'a1', 'a2', 'a3'])
+            info = cmd.parse_cache_info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                BUILTINS['parsecache'](['parsecache'])
+            self.assertTrue(out.getvalue().startswith('hits 1 misses 1 (50% hit rate)'), out.getvalue())
+            BUILTINS['parsecache'](['parsecache', '-r'])
+            self.assertEqual(cmd.parse_cache_info().currsize, 0)
 
+    unittest.main()
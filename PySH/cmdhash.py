@@ -0,0 +1,165 @@
+"""
+This module maps command names to absolute paths, like the bash hash table.
+
+Directory listings of $PATH entries are cached by directory mtime, so a
+lookup never has to try a failed exec in each directory. The table is
+dropped whenever $PATH changes.
+"""
+
+import os
+import stat
+
+
+_path = None
+_dirs = []
+_listings = {}  # dir -> (st_mtime_ns, frozenset of names)
+_table = {}     # name -> [path, dir index, hits]
+
+
+def _check_path():
+    global _path
+    global _dirs
+
+    path = os.environ.get('PATH', os.defpath)
+    if path != _path:
+        _path = path
+        _dirs = path.split(os.pathsep)
+        _table.clear()
+
+def _mtime(d):
+    try:
+        return os.stat(d).st_mtime_ns
+    except OSError:
+        return None
+
+def listing(d):
+    mtime = _mtime(d)
+    entry = _listings.get(d)
+    if entry is None or entry[0] != mtime:
+        try:
+            names = frozenset(os.listdir(d))
+        except OSError:
+            names = frozenset()
+        entry = (mtime, names)
+        _listings[d] = entry
+    return entry[1]
+
+def is_executable(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and os.access(path, os.X_OK)
+
+def _search(name):
+    for idx, d in enumerate(_dirs):
+        if not os.path.isabs(d):
+            # relative entries follow the cwd and are never cached
+            path = os.path.join(d, name)
+            if is_executable(path):
+                return path, idx
+            continue
+        if name in listing(d):
+            path = os.path.join(d, name)
+            if is_executable(path):
+                return path, idx
+    return None, None
+
+def _valid(entry):
+    for d in _dirs[:entry[1] + 1]:
+        if not os.path.isabs(d):
+            return False
+        cached = _listings.get(d)
+        if cached is None or cached[0] != _mtime(d):
+            return False
+    return True
+
+def find_command(name):
+    """
+    Returns the absolute path for the command name, or None if it is not
+    found in $PATH. Names containing a '/' are returned unchanged.
+    """
+
+    if '/' in name:
+        return name
+
+    _check_path()
+
+    entry = _table.get(name)
+    if entry is not None and _valid(entry):
+        entry[2] += 1
+        return entry[0]
+
+    path, idx = _search(name)
+    if path is None:
+        _table.pop(name, None)
+        return None
+    _table[name] = [path, idx, 1]
+    return path
+
+def hashed():
+    _check_path()
+    return [(name, entry[0], entry[2]) for name, entry in sorted(_table.items())]
+
+def forget(name=None):
+    if name is None:
+        _table.clear()
+        _listings.clear()
+    else:
+        _table.pop(name, None)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.dirs = []
+            for name in ('a', 'b'):
+                d = os.path.join(self.tmp.name, name)
+                os.mkdir(d)
+                self.dirs.append(d)
+            self.saved_path = os.environ.get('PATH')
+            os.environ['PATH'] = os.pathsep.join(self.dirs)
+
+        def tearDown(self):
+            os.environ['PATH'] = self.saved_path
+            self.tmp.cleanup()
+            forget()
+
+        def mkexe(self, d, name):
+            path = os.path.join(d, name)
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n')
+            os.chmod(path, 0o755)
+            # make sure the directory mtime moves on coarse filesystems
+            st = os.stat(d)
+            os.utime(d, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            return path
+
+        def test_lookup(self):
+            self.assertIsNone(find_command('foo'))
+            path = self.mkexe(self.dirs[1], 'foo')
+            self.assertEqual(find_command('foo'), path)
+            self.assertEqual(find_command('foo'), path)
+            self.assertEqual(hashed(), [('foo', path, 2)])
+
+        def test_shadowed(self):
+            self.mkexe(self.dirs[1], 'foo')
+            find_command('foo')
+            path = self.mkexe(self.dirs[0], 'foo')
+            self.assertEqual(find_command('foo'), path)
+
+        def test_path_change(self):
+            path = self.mkexe(self.dirs[1], 'foo')
+            self.assertEqual(find_command('foo'), path)
+            os.environ['PATH'] = self.dirs[0]
+            self.assertIsNone(find_command('foo'))
+            self.assertEqual(hashed(), [])
+
+        def test_slash(self):
+            self.assertEqual(find_command('./foo'), './foo')
+
+    unittest.main()
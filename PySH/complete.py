@@ -0,0 +1,234 @@
+"""
+Tab completion for readline.
+
+In command position a word completes to builtins, registered Python
+commands and the executables on $PATH; after fg and bg, or starting with
+'%', to job ids; anywhere else, and whenever it contains a '/', to paths.
+
+Nothing is rescanned per keypress. The executables of each $PATH directory
+are taken from cmdhash.listing(), which is revalidated by the directory's
+mtime, and filtered once per listing. Paths come from pathglob.listing(),
+the sorted, mtime-checked scandir cache that globbing uses, so a prefix is
+a bisect into the names and a huge directory costs a stat once it is
+cached.
+"""
+
+from . import cmdhash
+from . import pathglob
+
+import bisect
+import os
+
+
+DELIMS = ' \t\n"\';|&()<>'
+
+_executables = {}  # PATH dir -> (cmdhash listing it came from, sorted executable names)
+
+_separators = frozenset(('|', '||', '&', '&&', ';', '(', ')'))
+
+
+def _prefixed(names, prefix):
+    # names is sorted, so the matches are one slice
+    if not prefix:
+        return names
+    start = bisect.bisect_left(names, prefix)
+    end = bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+    return names[start:end]
+
+def _dir_executables(d):
+    names = cmdhash.listing(d)
+    entry = _executables.get(d)
+    if entry is None or entry[0] is not names:
+        entry = (names, sorted(n for n in names if cmdhash.is_executable(os.path.join(d, n))))
+        _executables[d] = entry
+    return entry[1]
+
+def complete_command(prefix):
+    from .builtins import BUILTINS
+    from .pycmd import commands
+
+    found = set(name for name in BUILTINS if name.startswith(prefix))
+    found.update(name for name in commands() if name.startswith(prefix))
+    for d in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        if os.path.isabs(d):
+            found.update(_prefixed(_dir_executables(d), prefix))
+    return sorted(found)
+
+def complete_path(text, dirs_only=False):
+    """Returns the paths starting with text, directories with a trailing '/'."""
+
+    head, sep, base = text.rpartition('/')
+    directory = head + sep
+    listing_dir = os.path.expanduser(directory) if directory else '.'
+    names, dirs = pathglob.listing(listing_dir)
+    matches = []
+    hidden = base.startswith('.')
+    for name in _prefixed(names, base):
+        if name[0] == '.' and not hidden:
+            continue
+        if name in dirs:
+            matches.append(directory + name + '/')
+        elif not dirs_only:
+            matches.append(directory + name)
+    return matches
+
+def complete_job(text):
+    from .job import jobs
+
+    percent = '%' if text.startswith('%') else ''
+    ids = [percent + str(job.job_id) for job in jobs()]
+    return [x for x in ids if x.startswith(text)]
+
+def _words(line):
+    # rough split of the text before the word being completed, enough to
+    # find the command it belongs to
+    for sep in ('&&', '||'):
+        line = line.replace(sep, ' ; ')
+    for sep in '|&;()':
+        line = line.replace(sep, ' ; ')
+    return line.split()
+
+def complete(line, begin, text):
+    """Returns the completions for text, the word at begin in line."""
+
+    before = _words(line[:begin])
+    start = len(before)
+    while start and before[start - 1] not in _separators:
+        start -= 1
+    words = before[start:]
+    if text.startswith('%') or (words and words[0] in ('fg', 'bg') and len(words) == 1):
+        return complete_job(text)
+    if '/' in text or text.startswith('~'):
+        if not words and not text.startswith('~'):
+            # ./script: only what can be run, and directories to go into
+            return [p for p in complete_path(text) if p.endswith('/') or
+                    cmdhash.is_executable(os.path.expanduser(p))]
+        return complete_path(text)
+    if not words:
+        return complete_command(text)
+    return complete_path(text, dirs_only=words[0] in ('cd', 'pushd'))
+
+
+class Completer:
+    """The readline completer: computes the matches for state 0, then returns them one by one."""
+
+    __slots__ = ('readline', 'matches')
+
+    def __init__(self, readline):
+        self.readline = readline
+        self.matches = []
+
+    def __call__(self, text, state):
+        if state == 0:
+            readline = self.readline
+            try:
+                self.matches = complete(readline.get_line_buffer(), readline.get_begidx(), text)
+            except Exception:
+                self.matches = []
+            if len(self.matches) == 1 and not self.matches[0].endswith('/'):
+                self.matches[0] += ' '
+        return self.matches[state] if state < len(self.matches) else None
+
+
+def install(readline):
+    readline.set_completer_delims(DELIMS)
+    readline.set_completer(Completer(readline))
+    readline.parse_and_bind('tab: complete')
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.cwd = os.getcwd()
+            os.chdir(self.tmp.name)
+            self.saved_path = os.environ.get('PATH')
+            os.mkdir('bin')
+            for name in ('zzcmd-one', 'zzcmd-two'):
+                self.touch(os.path.join('bin', name), 0o755)
+            self.touch(os.path.join('bin', 'zzcmd-data'), 0o644)
+            os.environ['PATH'] = os.pathsep.join((os.path.abspath('bin'), self.saved_path))
+
+        def tearDown(self):
+            os.environ['PATH'] = self.saved_path
+            os.chdir(self.cwd)
+            self.tmp.cleanup()
+
+        def touch(self, path, mode=0o644):
+            open(path, 'w').close()
+            os.chmod(path, mode)
+
+        def test_prefixed(self):
+            names = ['a', 'ab', 'abc', 'abd', 'b']
+            self.assertEqual(_prefixed(names, 'ab'), ['ab', 'abc', 'abd'])
+            self.assertEqual(_prefixed(names, ''), names)
+            self.assertEqual(_prefixed(names, 'c'), [])
+
+        def test_commands(self):
+            self.assertEqual(complete('zzc', 0, 'zzc'), ['zzcmd-one', 'zzcmd-two'])
+            self.assertIn('pushd', complete('pu', 0, 'pu'))
+            self.assertEqual(complete('ls | zzcmd-o', 5, 'zzcmd-o'), ['zzcmd-one'])
+            # a new executable shows up once the directory mtime changes
+            self.touch(os.path.join('bin', 'zzcmd-three'), 0o755)
+            st = os.stat('bin')
+            os.utime('bin', ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            self.assertEqual(complete('zzcmd-t', 0, 'zzcmd-t'), ['zzcmd-three', 'zzcmd-two'])
+
+        def test_paths(self):
+            os.mkdir('dir')
+            self.touch('dir/file')
+            self.touch('dir/.hidden')
+            self.touch('data')
+            self.assertEqual(complete('cat d', 4, 'd'), ['data', 'dir/'])
+            self.assertEqual(complete('cd d', 3, 'd'), ['dir/'])
+            self.assertEqual(complete('cat dir/', 4, 'dir/'), ['dir/file'])
+            self.assertEqual(complete('cat dir/.', 4, 'dir/.'), ['dir/.hidden'])
+            self.assertEqual(complete('bin/', 0, 'bin/'), ['bin/zzcmd-one', 'bin/zzcmd-two'])
+
+        def test_jobs(self):
+            from .job import Job, add_job, remove_job
+
+            job = Job('sleep')
+            add_job(job)
+            try:
+                self.assertEqual(complete('fg ', 3, ''), [str(job.job_id)])
+                self.assertEqual(complete('kill %', 5, '%'), ['%' + str(job.job_id)])
+            finally:
+                remove_job(job)
+
+        def test_completer(self):
+            class Readline:
+                def __init__(self, line):
+                    self.line = line
+
+                def get_line_buffer(self):
+                    return self.line
+
+                def get_begidx(self):
+                    return self.line.rfind(' ') + 1
+
+            completer = Completer(Readline('echo zzcmd-o'))
+            self.assertEqual([completer('zzcmd-o', 0), completer('zzcmd-o', 1)], [None, None])
+            completer = Completer(Readline('zzcmd-o'))
+            self.assertEqual([completer('zzcmd-o', 0), completer('zzcmd-o', 1)], ['zzcmd-one ', None])
+
+        def test_huge_directory(self):
+            os.mkdir('huge')
+            for i in range(100000):
+                os.close(os.open('huge/file{}'.format(i), os.O_CREAT | os.O_WRONLY, 0o644))
+            complete('cat huge/', 4, 'huge/file9999') # fills the cache
+            start = time.perf_counter()
+            matches = complete('cat huge/', 4, 'huge/file1234')
+            elapsed = time.perf_counter() - start
+            self.assertEqual(len(matches), 11)
+            self.assertLess(elapsed, 0.01)
+            start = time.perf_counter()
+            matches = complete('cat huge/', 4, 'huge/file1')
+            self.assertEqual(len(matches), 11111)
+            self.assertLess(time.perf_counter() - start, 0.01)
+
+    unittest.main()
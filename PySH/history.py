@@ -0,0 +1,345 @@
+"""
+Append-only command history shared by concurrent shells.
+
+Every command is appended to ~/.pysh-history as soon as it is entered, as
+one 'timestamp<TAB>command' line written with a single O_APPEND write, so
+shells running side by side interleave their entries instead of
+overwriting each other's. Newlines and backslashes in a command are
+escaped; lines from the readline format that came before have no
+timestamp and are read as they are.
+
+Next to it, ~/.pysh-history.offsets holds the start offset of every line as
+an array of 64-bit integers behind a small header recording the history
+file's inode and how many bytes it covers. It is brought up to date
+incrementally, by scanning only the lines appended since, and read through
+mmap, so loading the recent tail at startup and numbering an entry need no
+pass over the whole file. It is not a search index: a search is a linear
+mmap.find() scan of the history, O(n) in its size, which compaction keeps
+below MAX_BYTES.
+
+When the file grows past MAX_BYTES it is compacted, keeping the newest
+entries up to half of that, under an flock() that appends take as well.
+"""
+
+import array
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+
+HISTFILE = os.path.join(os.path.expanduser('~'), '.pysh-history')
+LOAD_ENTRIES = 1000     # entries given to readline at startup
+MAX_BYTES = 16 << 20    # compact when the file is larger
+
+_MAGIC = b'PYSHOFF1'
+_header = struct.Struct('=8sQQ')  # magic, history inode, bytes covered; native order like the offsets
+
+
+def _escape(line):
+    return line.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    out = []
+    chars = iter(text)
+    for c in chars:
+        if c == '\\':
+            c = next(chars, '\\')
+            out.append('\n' if c == 'n' else c)
+        else:
+            out.append(c)
+    return ''.join(out)
+
+def encode(line, when):
+    return '{}\t{}\n'.format(int(when), _escape(line)).encode('utf-8', 'surrogateescape')
+
+def decode(record):
+    """Returns (timestamp, command) for one line of the file, without its newline."""
+
+    text = record.decode('utf-8', 'surrogateescape')
+    stamp, tab, line = text.partition('\t')
+    if tab and stamp.isdigit():
+        return int(stamp), _unescape(line)
+    return 0, text # written by readline, no timestamp and no escapes
+
+
+class History:
+    __slots__ = ('path', 'offsets_path')
+
+    def __init__(self, path=HISTFILE):
+        self.path = path
+        self.offsets_path = path + '.offsets'
+
+    def _open_locked(self):
+        # the file that is at path once the lock is held, which a compaction
+        # may have replaced while we waited
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def append(self, line, when=None):
+        fd = self._open_locked()
+        try:
+            os.write(fd, encode(line, time.time() if when is None else when))
+            size = os.fstat(fd).st_size
+            if size > MAX_BYTES:
+                self._compact(fd, MAX_BYTES // 2)
+        finally:
+            os.close(fd)
+
+    def compact(self, max_bytes=MAX_BYTES // 2):
+        """Rewrites the file with only the newest entries that fit in max_bytes."""
+
+        fd = self._open_locked()
+        try:
+            self._compact(fd, max_bytes)
+        finally:
+            os.close(fd)
+
+    def _compact(self, fd, max_bytes):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        data = data[:data.rfind(b'\n') + 1]
+        if len(data) > max_bytes:
+            start = data.find(b'\n', len(data) - max_bytes - 1) + 1
+            data = data[start:]
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)  # the offset table sees the new inode and starts over
+
+    def _update_offsets(self):
+        """
+        Brings the offset table up to date with the history file and returns
+        (history fd, bytes covered, table fd, entries covered), the fds open
+        for reading.
+        """
+
+        hist = os.open(self.path, os.O_RDONLY | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            size = os.fstat(hist).st_size
+            ino = os.fstat(hist).st_ino
+            table = os.open(self.offsets_path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        except OSError:
+            os.close(hist)
+            raise
+        try:
+            fcntl.flock(table, fcntl.LOCK_EX)
+            header = os.pread(table, _header.size, 0)
+            magic, table_ino, covered = _header.unpack(header) if len(header) == _header.size \
+                                          else (None, 0, 0)
+            tsize = os.fstat(table).st_size
+            if magic != _MAGIC or table_ino != ino or covered > size or \
+               (tsize - _header.size) % 8:
+                covered = 0
+                os.ftruncate(table, _header.size)
+                tsize = _header.size
+            if covered < size:
+                offsets = array.array('Q')
+                with mmap.mmap(hist, size, prot=mmap.PROT_READ) as m:
+                    find = m.find
+                    pos = covered
+                    while True:
+                        nl = find(b'\n', pos)
+                        if nl < 0:
+                            break
+                        offsets.append(pos)
+                        pos = nl + 1
+                if offsets:
+                    os.pwrite(table, offsets.tobytes(), tsize)
+                    tsize += len(offsets) * 8
+                    covered = pos
+                os.pwrite(table, _header.pack(_MAGIC, ino, covered), 0)
+            fcntl.flock(table, fcntl.LOCK_UN)
+            # another shell may extend both files from here on
+            return hist, covered, table, (tsize - _header.size) // 8
+        except BaseException:
+            os.close(hist)
+            os.close(table)
+            raise
+
+    def _read(self, func):
+        # calls func(history mmap, offsets) with both mapped, offsets being
+        # the start of each entry covered
+        hist, covered, table, count = self._update_offsets()
+        try:
+            if covered == 0:
+                return func(b'', ())
+            with mmap.mmap(hist, covered, prot=mmap.PROT_READ) as m, \
+                 mmap.mmap(table, _header.size + count * 8, prot=mmap.PROT_READ) as im:
+                view = memoryview(im)[_header.size:].cast('Q')
+                try:
+                    return func(m, view)
+                finally:
+                    view.release()
+        finally:
+            os.close(hist)
+            os.close(table)
+
+    def __len__(self):
+        return self._read(lambda m, offsets: len(offsets))
+
+    def tail(self, count=LOAD_ENTRIES):
+        """Returns the newest count entries as (number, timestamp, command), oldest first."""
+
+        def read(m, offsets):
+            first = max(0, len(offsets) - count)
+            if first == len(offsets):
+                return []
+            records = m[offsets[first]:].split(b'\n')[:-1]
+            return [(first + i + 1,) + decode(record) for i, record in enumerate(records)]
+        return self._read(read)
+
+    def search(self, text, limit=None):
+        """
+        Returns the entries containing text as (number, timestamp, command),
+        oldest first, at most the newest limit of them. Scans the whole file,
+        the offset table only numbers the hits.
+        """
+
+        needle = _escape(text).encode('utf-8', 'surrogateescape')
+
+        def read(m, offsets):
+            found = []
+            find = m.find
+            pos = 0
+            while True:
+                hit = find(needle, pos)
+                if hit < 0:
+                    break
+                n = bisect.bisect_right(offsets, hit) - 1
+                end = find(b'\n', hit)
+                stamp, line = decode(m[offsets[n]:end])
+                if text in line: # not just in the timestamp
+                    found.append((n + 1, stamp, line))
+                pos = end + 1
+            return found[-limit:] if limit else found
+        return self._read(read)
+
+
+def format_entry(number, stamp, line):
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(stamp)) if stamp else '-'
+    return '{:>6}  {:<16}  {}'.format(number, when, line)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.history = History(os.path.join(self.tmp.name, 'history'))
+
+        def tearDown(self):
+            self.tmp.cleanup()
+
+        def test_append(self):
+            h = self.history
+            h.append('ls -l', when=100)
+            h.append('echo "a\\nb"\nsecond line', when=200)
+            self.assertEqual(h.tail(), [(1, 100, 'ls -l'), (2, 200, 'echo "a\\nb"\nsecond line')])
+            self.assertEqual(h.tail(1), [(2, 200, 'echo "a\\nb"\nsecond line')])
+            self.assertEqual(len(h), 2)
+            with open(h.path, 'rb') as f:
+                self.assertEqual(f.read().count(b'\n'), 2)
+
+        def test_readline_format(self):
+            with open(self.history.path, 'w') as f:
+                f.write('make all\nls a\\b\n')
+            self.history.append('git status', when=5)
+            self.assertEqual(self.history.tail(), [(1, 0, 'make all'), (2, 0, 'ls a\\b'), (3, 5, 'git status')])
+
+        def test_search(self):
+            h = self.history
+            for i in range(1000):
+                h.append('cmd {} {}'.format(i, 'needle' if i % 100 == 7 else 'hay'), when=1000 + i)
+            found = h.search('needle')
+            self.assertEqual([n for n, stamp, line in found], [i + 1 for i in range(7, 1000, 100)])
+            self.assertEqual(found[0], (8, 1007, 'cmd 7 needle'))
+            self.assertEqual(len(h.search('needle', limit=3)), 3)
+            # a hit in the timestamp only is not a match
+            self.assertEqual(h.search('1007'), [])
+            self.assertEqual(h.search('nothing'), [])
+
+        def test_incremental_offsets(self):
+            h = self.history
+            for i in range(10):
+                h.append('first {}'.format(i))
+            self.assertEqual(len(h), 10)
+            size = os.path.getsize(h.offsets_path)
+            # another shell appending in between
+            other = History(h.path)
+            for i in range(5):
+                other.append('second {}'.format(i))
+            self.assertEqual(h.tail(2)[-1][2], 'second 4')
+            self.assertEqual(os.path.getsize(h.offsets_path), size + 5 * 8)
+            # a stale or damaged offset table is rebuilt
+            with open(h.offsets_path, 'r+b') as f:
+                f.write(b'garbage!')
+            self.assertEqual(len(h), 15)
+
+        def test_compact(self):
+            global MAX_BYTES
+
+            h = self.history
+            saved = MAX_BYTES
+            MAX_BYTES = 4096
+            try:
+                for i in range(500):
+                    h.append('command number {}'.format(i), when=1)
+            finally:
+                MAX_BYTES = saved
+            self.assertLessEqual(os.path.getsize(h.path), 4096)
+            tail = h.tail()
+            self.assertEqual(tail[-1][1:], (1, 'command number 499'))
+            self.assertEqual([line for n, stamp, line in tail],
+                             ['command number {}'.format(i) for i in range(500 - len(tail), 500)])
+            h.compact(100)
+            self.assertLessEqual(os.path.getsize(h.path), 100)
+            self.assertEqual(h.tail()[-1][2], 'command number 499')
+
+        def test_concurrent(self):
+            import multiprocessing
+
+            def writer(tag):
+                history = History(self.history.path)
+                for i in range(200):
+                    history.append('{} {}'.format(tag, i))
+
+            procs = [multiprocessing.Process(target=writer, args=(tag,)) for tag in 'abcd']
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            lines = [line for n, stamp, line in self.history.tail(10000)]
+            self.assertEqual(len(lines), 800)
+            for tag in 'abcd':
+                self.assertEqual([x for x in lines if x[0] == tag], ['{} {}'.format(tag, i) for i in range(200)])
+
+        def test_search_speed(self):
+            h = self.history
+            with open(h.path, 'wb') as f:
+                f.write(b''.join(encode('make -j8 target{}'.format(i), 1700000000) for i in range(200000)))
+            len(h) # builds the offset table
+            start = time.perf_counter()
+            found = h.search('target199999')
+            elapsed = time.perf_counter() - start
+            self.assertEqual(found[0][0], 200000)
+            self.assertLess(elapsed, 0.1)
+            start = time.perf_counter()
+            self.assertEqual(len(h.tail()), LOAD_ENTRIES)
+            self.assertLess(time.perf_counter() - start, 0.05)
+
+    unittest.main()
@@ -1,91 +1,217 @@
+from . import perf
+from .pipeio import make_pipe
+from .proc import _threads, _waiters, exit_status, forget_threads, wait_for, wake_waiters
+from .redirect import close_fds, open_redirects
 from .term import Terminal
 
-import errno
+import collections
 import os
 import signal
 import sys
+import time
 
 
 _terminal = Terminal()
 
 
-_first_job = None
+_jobs = {}          # job_id -> Job, in launch order
+_jobs_by_pgid = {}  # pgid -> Job
+_procs = {}         # pid -> Process
 _job_id = 1
 _last_found_job_id = 1
 
+_reaped = collections.deque()  # (pid, status, rusage, when) collected but not yet applied
+_reaper_installed = False
+_reaper_callback = None
+_starting = 0                  # jobs whose processes are being started
+_reap_deferred = False         # SIGCHLD came meanwhile
+_changed = {}                  # jobs with new status to report, in order
+_table_hooks = []              # called when a job is added or removed, see prompt.install()
+
+_status_markup = {
+    'Done': '${GREEN}Done${RESET}',
+    'Terminated': '${RED}Terminated${RESET}',
+    'Stopped': '${YELLOW}Stopped${RESET}',
+    'Running': 'Running',
+}
+
 
 def jobs():
-    job = _first_job
-    while job:
-        yield job
-        job = job.next
+    return iter(list(_jobs.values()))
+
+def job_count():
+    return len(_jobs)
 
 def add_job(job):
     global _job_id
-    global _first_job
 
     job.job_id = _job_id
     _job_id += 1
 
-    if _first_job is None:
-        _first_job = job
-    else:
-        j = _first_job
-        while j.next:
-            j = j.next
-        j.next = job
+    _jobs[job.job_id] = job
+    if job.pgid:
+        _jobs_by_pgid[job.pgid] = job
+    for proc in job.procs:
+        if proc.pid:
+            _procs[proc.pid] = proc
+    for hook in _table_hooks:
+        hook()
 
 def remove_job(job):
-    global _first_job
     global _job_id
 
-    last = None
-    for j in jobs():
-        if j is job:
-            if last:
-                last.next = job.next
-            else:
-                _first_job = job.next
-        last = j
-
-    if _first_job is None:
+    if _jobs.get(job.job_id) is not job:
+        return
+    del _jobs[job.job_id]
+    _changed.pop(job, None)
+    if _jobs_by_pgid.get(job.pgid) is job:
+        del _jobs_by_pgid[job.pgid]
+    for proc in job.procs:
+        if _procs.get(proc.pid) is proc:
+            del _procs[proc.pid]
+
+    if not _jobs:
         _job_id = 1
+    for hook in _table_hooks:
+        hook()
+
+def forget_jobs():
+    """In a forked child, drops the parent's jobs and threads, which are not its own."""
+
+    global _job_id
+
+    _jobs.clear()
+    _jobs_by_pgid.clear()
+    _procs.clear()
+    _reaped.clear()
+    _changed.clear()
+    _waiters.clear()
+    forget_threads()
+    _job_id = 1
 
 def find_job(pgid=None, job_id=None):
     global _last_found_job_id
 
     if pgid is None and job_id is None:
         job_id = _last_found_job_id
-    for job in jobs():
-        if (pgid and job.pgid == pgid) or (job_id and job.job_id == job_id):
-            if job_id:
-                _last_found_job_id = job_id
-            return job
+    job = None
+    if pgid:
+        job = _jobs_by_pgid.get(pgid)
+    if job is None and job_id:
+        job = _jobs.get(job_id)
+        if job is not None:
+            _last_found_job_id = job_id
+    return job
 
 def find_process(pid):
     if pid == 0:
         return 
-    for job in jobs():
-        for proc in job.procs:
-            if proc.pid == pid:
-                return proc
+    return _procs.get(pid)
 
-def update_status():
-    try:
-        while True:
-            pid, status = os.waitpid(-1, 3) # WAIT_ANY, WUNTRACED|WNOHANG
-            proc = find_process(pid)
-            if proc:
-                proc.mark_status(status)
-            else:
+def format_usage(obj):
+    """The resource usage of a Process or Job on one line."""
+
+    rss = obj.maxrss
+    if rss is None:
+        rss = '-' # not above the shell's own, see Process.mark_status()
+    else:
+        for unit in 'KMG':
+            if rss < 1024 or unit == 'G':
                 break
-    except OSError as e:
-        if e.errno is not errno.ECHILD:
-            raise
+            rss /= 1024
+        rss = '{}{}'.format(round(rss, 1) if unit != 'K' else rss, unit)
+    return 'real {:.3f}s user {:.3f}s sys {:.3f}s rss {}'.format(
+        obj.elapsed, obj.utime, obj.stime, rss)
+
+def _reap():
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG | os.WUNTRACED)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _reaped.append((pid, status, rusage, time.monotonic()))
+
+def _sigchld(signo, frame):
+    global _reap_deferred
+
+    if _starting:
+        # a stage that already exited stays a zombie until the rest of its
+        # job is started, so the process group they join still exists
+        _reap_deferred = True
+    else:
+        _reap()
+        if _reaper_callback is not None:
+            _reaper_callback()
+
+def install_reaper(callback=None):
+    """
+    Reaps children from a SIGCHLD handler, so a background job's status is
+    collected as soon as it changes and update_status() has nothing to poll.
+    callback, if given, runs in the handler after each reap.
+    """
+
+    global _reaper_installed, _reaper_callback
+
+    signal.signal(signal.SIGCHLD, _sigchld)
+    _reaper_installed = True
+    _reaper_callback = callback
+    _reap()
+
+def install_async_reaper(loop, callback=None):
+    """
+    Reaps children from the asyncio loop whenever SIGCHLD arrives, resolving
+    Job.wait_async() and Process.wait_async() waiters. callback, if given,
+    runs after each batch of status changes has been applied.
+    """
+
+    global _reaper_installed
+
+    def on_sigchld():
+        _reap()
+        update_status()
+        if callback is not None:
+            callback()
+
+    loop.add_signal_handler(signal.SIGCHLD, on_sigchld)
+    _reaper_installed = True
+    on_sigchld()
+
+def _apply_status(proc, status, rusage=None, when=None):
+    proc.mark_status(status, rusage, when)
+    job = proc.job
+    if job is not None:
+        _changed[job] = None
+    if _waiters:
+        wake_waiters(proc)
+        if job is not None and (job.stopped or job.completed):
+            wake_waiters(job)
+
+def update_status():
+    if not _reaper_installed:
+        _reap()
+    while _reaped:
+        pid, status, rusage, when = _reaped.popleft()
+        proc = _procs.get(pid)
+        if proc:
+            _apply_status(proc, status, rusage, when)
+    if _threads:
+        # in-process stages are collected here too, always on the main thread
+        for proc, thread in list(_threads.items()):
+            if not thread.is_alive():
+                del _threads[proc]
+                _apply_status(proc, proc.result)
+
+def pending_notices():
+    update_status()
+    return any(not job.notified and (job.completed or job.stopped) for job in _changed)
 
 def notify():
     update_status()
-    for job in jobs():
+    changed = list(_changed)
+    _changed.clear()
+    for job in changed:
         if job.completed:
             if not job.notified:
                 job.print_info()
@@ -97,71 +223,160 @@ def notify():
 
 
 class Job:
-    __slots__ = ('next', 'job_id', 'cmdline', 'procs', 'pgid', 'notified', 'tmodes', 'stdin', 'stdout', 'stderr')
+    __slots__ = ('job_id', 'cmdline', 'procs', 'pgid', 'notified', 'tmodes', 'stdin', 'stdout', 'stderr',
+                 'ncompleted', 'nstopped', 'pipe_size')
 
     def __init__(self, cmdline):
-        self.next = None
+        self.job_id = None
         self.cmdline = cmdline
         self.procs = []
+        self.ncompleted = 0
+        self.nstopped = 0  # stopped and not completed
         self.pgid = 0
         self.stdin = sys.stdin.fileno()
         self.stdout = sys.stdout.fileno()
         self.stderr = sys.stderr.fileno()
         self.notified = False
         self.tmodes = None
+        self.pipe_size = 0 # 0 for pipeio.PIPE_SIZE
 
     @property
     def stopped(self):
-        return all((p.completed or p.stopped for p in self.procs))
+        return self.ncompleted + self.nstopped == len(self.procs)
 
     @property
     def completed(self):
-        return all((p.completed for p in self.procs))
+        return self.ncompleted == len(self.procs)
 
     @property
     def terminated(self):
         return any((proc.term_signal for proc in self.procs))
 
+    @property
+    def returncode(self):
+        if not self.procs:
+            return 0
+        return self.procs[-1].returncode
+
+    @property
+    def utime(self):
+        return sum(proc.utime for proc in self.procs)
+
+    @property
+    def stime(self):
+        return sum(proc.stime for proc in self.procs)
+
+    @property
+    def maxrss(self):
+        return max((proc.maxrss for proc in self.procs if proc.maxrss is not None), default=None)
+
+    @property
+    def elapsed(self):
+        started = [proc for proc in self.procs if proc.start is not None]
+        if not started:
+            return 0.0
+        now = time.monotonic()
+        return max(proc.end or now for proc in started) - min(proc.start for proc in started)
+
+    def usage(self):
+        return {'job_id': self.job_id, 'cmdline': self.cmdline, 'returncode': self.returncode,
+                'elapsed': self.elapsed, 'utime': self.utime, 'stime': self.stime,
+                'maxrss': self.maxrss, 'procs': [proc.usage() for proc in self.procs]}
+
+    async def wait_async(self):
+        return await wait_for(self)
+
     def add_proc(self, proc):
+        proc.job = self
         self.procs.append(proc)
+        if proc.completed:
+            self.ncompleted += 1
+        elif proc.stopped:
+            self.nstopped += 1
+
+    def launch(self, fg=True, quiet=False):
+        global _starting, _reap_deferred
+
+        _starting += 1
+        try:
+            forked = self._start_procs(fg)
+        finally:
+            _starting -= 1
+        if _reap_deferred and not _starting:
+            _reap_deferred = False
+            _reap()
+
+        if not fg:
+            if forked:
+                if not quiet and _terminal.interactive:
+                    self.print_info(short=True)
+                self._background()
+        else:
+            with perf.span('wait'):
+                if not forked: # in-process stages only
+                    pass
+                elif not _terminal.interactive:
+                    self.wait()
+                else:
+                    self._foreground()
+                if not any(proc.stopped for proc in self.procs):
+                    self._join_threads()
+
+        if fg and self.completed:
+            self.notified = True
+            if _terminal.interactive:
+                _changed[self] = None
+            else:
+                # without a prompt notify() never runs to remove it
+                remove_job(self)
+
+    def _start_procs(self, fg):
+        """Starts the processes and stages, returns whether any was forked."""
 
-    def launch(self, fg=True):
         infile = self.stdin
+        forked = False
 
         for procidx, proc in enumerate(self.procs):
             if (len(self.procs) - procidx) > 1:
-                rfd, outfile = os.pipe()
+                rfd, outfile = make_pipe(self.pipe_size)
             else:
-                rfd = self.stdin
+                rfd = None
                 outfile = self.stdout
 
-            pid = proc.launch(self.pgid, infile, outfile, self.stderr, fg)
-
-            if pid is None: # builtin
-                pass
+            fds = {0: infile, 1: outfile, 2: self.stderr}
+            try:
+                opened = open_redirects(proc.redirects, fds) if proc.redirects else ()
+            except OSError as e:
+                print('pysh: {}: {}'.format(e.filename, e.strerror), file=sys.stderr)
+                proc.mark_status(exit_status(1))
+                pid = None
             else:
+                proc.start = time.monotonic()
+                try:
+                    pid = proc.launch(self.pgid, fds, fg)
+                finally:
+                    close_fds(opened)
+
+            if pid is not None:
+                forked = True
                 proc.pid = pid
+                _procs[pid] = proc
                 if _terminal.interactive:
                     if self.pgid == 0:
                         self.pgid = pid
-                    os.setpgid(pid, self.pgid)
-
-                if infile != self.stdin:
-                    os.close(infile)
-                if outfile != self.stdout:
-                    os.close(outfile)
-                infile = rfd
-
-                if not _terminal.interactive and fg:
-                    self.wait()
-                elif fg:
-                    self._foreground()
-                else:
-                    self.print_info(short=True)
-                    self._background()
-
-            if fg and self.completed:
-                self.notified = True
+                        if _jobs.get(self.job_id) is self:
+                            _jobs_by_pgid[pid] = self
+                    try:
+                        os.setpgid(pid, self.pgid)
+                    except PermissionError:
+                        pass # already exec'd, posix_spawn put it in the group
+
+            if infile != self.stdin:
+                os.close(infile)
+            if outfile != self.stdout:
+                os.close(outfile)
+            infile = rfd
+        return forked
 
     def continue_job(self, fg = True):
         self._mark_running()
@@ -170,25 +385,53 @@ class Job:
         else:
             self._background(True)
 
+    def _join_threads(self):
+        joined = False
+        for proc in self.procs:
+            thread = _threads.get(proc)
+            if thread is not None:
+                thread.join()
+                joined = True
+        if joined:
+            update_status()
+
     def wait(self):
-        try:
-            while True:
-                pid, status = os.waitpid(-1, 2) # WAIT_ANY, WUNTRACED
-                proc = find_process(pid)
-                if proc:
-                    proc.mark_status(status)
-                    if self.stopped or self.completed:
-                        break
-                else:
+        update_status()
+        while True:
+            if self.nstopped and _terminal.interactive:
+                self._continue_early_stop()
+            if self.stopped or self.completed:
+                break
+            # only watch this job, background jobs are left to the reaper
+            if self.pgid:
+                wpid = -self.pgid
+            else:
+                wpid = next((p.pid for p in self.procs if p.pid and not (p.completed or p.stopped)), None)
+                if wpid is None: # the rest run on threads
+                    break
+            progress = (self.ncompleted, self.nstopped)
+            try:
+                pid, status, rusage = os.wait4(wpid, os.WUNTRACED)
+                _reaped.append((pid, status, rusage, time.monotonic()))
+            except ChildProcessError:
+                # already collected by the SIGCHLD handler
+                update_status()
+                if progress == (self.ncompleted, self.nstopped):
                     break
-        except OSError as e:
-            if e.errno is not errno.ECHILD:
-                raise
+            update_status()
 
-    def print_info(self, short=False):
+    def print_info(self, short=False, file=None, usage=False):
+        """
+        Prints the job line ('[1] pid' when short) and with usage a line for
+        each process with its pid, status and resource usage.
+        """
+
+        if file is None:
+            file = sys.stderr
         if short:
             assert(len(self.procs) > 0)
-            print('[{}] {}'.format(self.job_id, self.procs[-1].pid), file=sys.stderr)
+            pid = next((p.pid for p in reversed(self.procs) if p.pid), self.pgid)
+            print('[{}] {}'.format(self.job_id, pid), file=file)
         else:
             if self.completed:
                 if self.terminated:
@@ -199,15 +442,46 @@ class Job:
                 status = 'Stopped'
             else:
                 status = 'Running'
-            print('[{}]\t{}\t\t{}'.format(self.job_id, status, self.cmdline), file=sys.stderr)
+            from .ansi import ANSI_MAP, DEFAULT_MAP, map_string
+
+            line = map_string('[{}]\t' + _status_markup[status] + '\t\t{}',
+                              ANSI_MAP if file.isatty() else DEFAULT_MAP)
+            print(line.format(self.job_id, self.cmdline), file=file)
+            if usage:
+                for proc in self.procs:
+                    if proc.completed:
+                        state = 'exit {}'.format(proc.returncode)
+                    else:
+                        state = 'Stopped' if proc.stopped else 'Running'
+                    print('\t{:>7} {:<8} {}\t{}'.format(proc.pid or '-', state, format_usage(proc),
+                                                        ' '.join(proc.argv)), file=file)
+
+    def _continue_early_stop(self):
+        """
+        Continues the job if a process stopped on SIGTTIN or SIGTTOU while
+        its group has the terminal: a posix_spawn()ed first stage can touch
+        the terminal before the shell hands it over.
+        """
+
+        if not any(p.stopped and os.WSTOPSIG(p.status) in (signal.SIGTTIN, signal.SIGTTOU)
+                   for p in self.procs):
+            return
+        if _terminal.foreground_pgid() != self.pgid:
+            return # really in the background
+        self._mark_running()
+        os.kill(-self.pgid, signal.SIGCONT)
 
     def _mark_running(self):
         for proc in self.procs:
             proc.stopped = False
+        self.nstopped = 0
         self.notified = False
 
     def _foreground(self, cont=False):
-        _terminal.grab_control(self.pgid)
+        try:
+            _terminal.grab_control(self.pgid)
+        except ProcessLookupError:
+            pass # done and reaped already, the group is gone
         if cont:
             if self.tmodes:
                 _terminal.restore_attributes(self.tmodes)
@@ -220,3 +494,206 @@ class Job:
         if cont:
             os.kill(-self.pgid, signal.SIGCONT)
 
+
+
+if __name__ == '__main__':
+    import unittest
+
+    from .proc import Process, exit_status
+
+    class TestCase(unittest.TestCase):
+        def tearDown(self):
+            for job in jobs():
+                remove_job(job)
+
+        def make_job(self, pids):
+            job = Job('test')
+            for pid in pids:
+                proc = Process(['test'])
+                proc.pid = pid
+                job.add_proc(proc)
+            job.pgid = pids[0]
+            add_job(job)
+            return job
+
+        def test_table(self):
+            jobs_ = [self.make_job([100 + 2 * i, 101 + 2 * i]) for i in range(100)]
+            self.assertIs(find_job(job_id=50), jobs_[49])
+            self.assertIs(find_job(pgid=110), jobs_[5])
+            self.assertIs(find_process(111), jobs_[5].procs[1])
+            remove_job(jobs_[5])
+            self.assertIsNone(find_job(pgid=110))
+            self.assertIsNone(find_process(111))
+            self.assertEqual(len(list(jobs())), 99)
+
+        def test_counters(self):
+            job = self.make_job([200, 201])
+            self.assertFalse(job.stopped)
+            job.procs[0].mark_status(0x137f) # stopped by SIGSTOP
+            self.assertFalse(job.stopped)
+            job.procs[1].mark_status(exit_status(0))
+            self.assertTrue(job.stopped)
+            self.assertFalse(job.completed)
+            job.procs[1].mark_status(exit_status(0))
+            job.procs[0].mark_status(exit_status(1))
+            self.assertTrue(job.completed)
+            self.assertEqual((job.ncompleted, job.nstopped), (2, 0))
+            self.assertEqual(job.returncode, 0)
+
+        def test_done_removed(self):
+            # without a prompt nothing calls notify()
+            job = Job('true')
+            job.add_proc(Process(['true']))
+            add_job(job)
+            job.launch()
+            self.assertTrue(job.completed)
+            self.assertEqual(job_count(), 0)
+
+        def test_thread_stage(self):
+            from .proc import Thread_Process
+
+            class Upper(Thread_Process):
+                __slots__ = ()
+
+                def _run(self):
+                    for line in sys.stdin:
+                        sys.stdout.write(line.upper())
+                    return 3
+
+            rfd, wfd = os.pipe()
+            job = Job('printf | upper')
+            job.stdout = wfd
+            job.add_proc(Process(['printf', 'a\\nb\\n']))
+            job.add_proc(Upper(['upper']))
+            add_job(job)
+            job.launch()
+            os.close(wfd)
+            with open(rfd) as f:
+                self.assertEqual(f.read(), 'A\nB\n')
+            self.assertTrue(job.completed)
+            self.assertEqual(job.returncode, 3)
+
+            # a stage without _run() is caught before it is launched
+            class Incomplete(Thread_Process):
+                __slots__ = ()
+
+            self.assertRaises(TypeError, Incomplete, ['incomplete'])
+
+            # a forked stage neither sees the thread as its own nor keeps
+            # its pipe open
+            from .builtins import Builtin_Process
+
+            rfd, wfd = os.pipe()
+            job = Job('printf | upper | time cat')
+            job.stdout = wfd
+            job.stderr = os.open(os.devnull, os.O_WRONLY)
+            job.add_proc(Process(['printf', 'a\\nb\\n']))
+            job.add_proc(Upper(['upper']))
+            job.add_proc(Builtin_Process(['time', 'cat']))
+            add_job(job)
+            job.launch()
+            os.close(wfd)
+            os.close(job.stderr)
+            with open(rfd) as f:
+                self.assertEqual(f.read(), 'A\nB\n')
+            self.assertEqual(job.returncode, 0)
+
+        def test_jobs_builtin(self):
+            # the job table jobs reads, not the one of this __main__ module
+            from . import job as table
+            from .builtins import Builtin_Process
+
+            sleeper = table.Job('sleep 0.2')
+            sleeper.add_proc(Process(['sleep', '0.2']))
+            table.add_job(sleeper)
+            sleeper.launch(fg=False, quiet=True)
+            # only the job running jobs is left out, in the table or not
+            for in_table in (True, False):
+                for pipeline in (True, False):
+                    rfd, wfd = os.pipe()
+                    job = table.Job('jobs')
+                    job.add_proc(Builtin_Process(['jobs']))
+                    if pipeline:
+                        job.stdout = wfd
+                        job.add_proc(Process(['cat']))
+                    else:
+                        job.procs[0].redirects = [(1, '>&', str(wfd))]
+                    if in_table:
+                        table.add_job(job)
+                    job.launch()
+                    os.close(wfd)
+                    with open(rfd) as f:
+                        self.assertEqual(f.read().split()[1:], ['Running', 'sleep', '0.2'])
+                    table.remove_job(job)
+            # nor the time job around it
+            rfd, wfd = os.pipe()
+            job = table.Job('time jobs')
+            job.add_proc(Builtin_Process(['time', 'jobs']))
+            job.procs[0].redirects = [(1, '>&', str(wfd)), (2, '>&', '-')]
+            table.add_job(job)
+            job.launch()
+            os.close(wfd)
+            with open(rfd) as f:
+                self.assertEqual(f.read().split()[1:], ['Running', 'sleep', '0.2'])
+            table.remove_job(job)
+            sleeper.wait()
+            table.remove_job(sleeper)
+
+        def test_usage(self):
+            import json
+
+            job = Job('sh | sleep')
+            job.add_proc(Process(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done']))
+            job.add_proc(Process(['sleep', '0.1']))
+            add_job(job)
+            job.launch()
+            self.assertTrue(job.completed)
+            busy, sleep = job.procs
+            self.assertGreater(busy.utime + busy.stime, 0)
+            self.assertIsNone(busy.maxrss) # never above what it inherited
+            self.assertTrue(0.1 <= sleep.elapsed < 1, sleep.elapsed)
+            self.assertEqual(job.elapsed, max(busy.end, sleep.end) - min(busy.start, sleep.start))
+            self.assertEqual(job.utime, busy.utime + sleep.utime)
+            usage = json.loads(json.dumps(job.usage()))
+            self.assertEqual(usage['procs'][1]['argv'], ['sleep', '0.1'])
+            self.assertIn('real 0.1', format_usage(sleep))
+
+        def test_maxrss(self):
+            import resource
+
+            job = Job('true | python3')
+            job.add_proc(Process(['true']))
+            job.add_proc(Process([sys.executable, '-c', 'x = b"x" * (256 << 20)']))
+            add_job(job)
+            job.launch()
+            small, big = job.procs
+            shell = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # not charged with the shell's peak
+            self.assertIsNone(small.maxrss)
+            self.assertIn('rss -', format_usage(small))
+            self.assertGreater(big.maxrss, max(256 << 10, shell))
+            self.assertEqual(job.maxrss, big.maxrss)
+
+        def test_wait_async(self):
+            import asyncio
+
+            async def run():
+                install_async_reaper(asyncio.get_running_loop())
+                jobs_ = []
+                for i in range(20):
+                    job = Job('sleep')
+                    job.add_proc(Process(['sleep', '0.{}'.format(i % 3)]))
+                    add_job(job)
+                    job.launch(fg=False)
+                    jobs_.append(job)
+                failing = Job('false')
+                failing.add_proc(Process(['false']))
+                add_job(failing)
+                failing.launch(fg=False)
+                return await asyncio.gather(failing.wait_async(),
+                                            failing.procs[0].wait_async(),
+                                            *(job.wait_async() for job in jobs_))
+
+            self.assertEqual(asyncio.run(run()), [1, 1] + [0] * 20)
+
+    unittest.main()
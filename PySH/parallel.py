@@ -0,0 +1,298 @@
+"""
+Bounded concurrent jobs, for the parallel builtin.
+
+    find . -name '*.png' | parallel -j 8 optipng -q
+    parallel gzip -9 {}.tar ::: a b c
+
+Every command is an ordinary background Job in the job table, launched
+quietly, with stdin on /dev/null and stdout/stderr in temporary files that
+are copied out as a block once it completes, so the output of concurrent
+commands never interleaves. With keep_order, the output of commands that
+finish ahead of their turn is moved into one spool file, so only running
+commands hold temporary files open. Completions are collected as they
+happen: with SIGCHLD blocked the scheduler reaps, refills the free slots
+and sleeps in sigtimedwait() until the next child exits.
+"""
+
+from .job import Job, _reap, add_job, remove_job, update_status
+from .pipeio import COPY_SIZE, copy_fd
+
+import os
+import signal
+import sys
+import tempfile
+import time
+
+
+_POLL = 0.05  # seconds, for in-process stages which send no SIGCHLD
+
+
+class Result:
+    __slots__ = ('argv', 'returncode', 'elapsed', 'cpu')
+
+    def __init__(self, argv, returncode, elapsed, cpu):
+        self.argv = argv
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.cpu = cpu
+
+
+class _Running:
+    __slots__ = ('index', 'job', 'out', 'err')
+
+    def __init__(self, index, job, out, err):
+        self.index = index
+        self.job = job
+        self.out = out
+        self.err = err
+
+
+class _Spool:
+    """The output of commands that finished ahead of their turn, in one file."""
+
+    __slots__ = ('file', 'held')
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.held = {}  # index -> (offset, stdout bytes, stderr bytes)
+
+    def hold(self, running):
+        fd = self.file.fileno()
+        offset = os.lseek(fd, 0, os.SEEK_END)
+        sizes = []
+        for f in (running.out, running.err):
+            f.seek(0)
+            sizes.append(copy_fd(f.fileno(), fd))
+            f.close()
+        self.held[running.index] = (offset, sizes[0], sizes[1])
+
+    def emit(self, index, outfd, errfd):
+        offset, out_size, err_size = self.held.pop(index)
+        _copy_range(self.file.fileno(), offset, out_size, outfd)
+        _copy_range(self.file.fileno(), offset + out_size, err_size, errfd)
+        if not self.held:
+            os.ftruncate(self.file.fileno(), 0)
+
+    def close(self):
+        self.file.close()
+
+
+def make_commands(template, items, per_command=1):
+    """
+    Yields an argv per per_command items: template with every {} replaced
+    by the items joined with spaces, or with the items appended when it
+    has no {}.
+    """
+
+    replace = any('{}' in arg for arg in template)
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == per_command:
+            yield _fill(template, batch, replace)
+            batch = []
+    if batch:
+        yield _fill(template, batch, replace)
+
+def _fill(template, batch, replace):
+    if replace:
+        return [arg.replace('{}', ' '.join(batch)) for arg in template]
+    return template + batch
+
+def _wait_for_child(timeout):
+    if hasattr(signal, 'sigtimedwait'):
+        signal.sigtimedwait((signal.SIGCHLD,), timeout)
+    else:
+        time.sleep(timeout)
+
+def _start(index, argv, devnull):
+    from .proc_factory import create_proc
+
+    job = Job(' '.join(argv))
+    job.stdin = devnull
+    out = tempfile.TemporaryFile()
+    err = tempfile.TemporaryFile()
+    job.stdout = out.fileno()
+    job.stderr = err.fileno()
+    job.notified = True # reported by the scheduler, not by notify()
+    job.add_proc(create_proc(argv))
+    add_job(job)
+    running = _Running(index, job, out, err)
+    job.launch(fg=False, quiet=True)
+    return running
+
+def _emit(running, outfd, errfd):
+    for f, fd in ((running.out, outfd), (running.err, errfd)):
+        f.seek(0)
+        copy_fd(f.fileno(), fd)
+        f.close()
+
+def _copy_range(fd, offset, size, outfd):
+    while size:
+        data = os.pread(fd, min(size, COPY_SIZE), offset)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            n = os.write(outfd, view)
+            view = view[n:]
+        offset += len(data)
+        size -= len(data)
+
+def run_parallel(commands, max_jobs=None, keep_order=False, outfd=None, errfd=None):
+    """
+    Runs each argv from commands (any iterable, consumed lazily) with at
+    most max_jobs (default os.cpu_count()) at a time and returns a Result
+    for each, in input order. The output of each command is written to
+    outfd and errfd (default the shell's stdout and stderr) when it
+    completes, or in input order with keep_order.
+    """
+
+    max_jobs = max_jobs or os.cpu_count() or 1
+    if outfd is None:
+        sys.stdout.flush()
+        outfd = sys.stdout.fileno()
+    if errfd is None:
+        sys.stderr.flush()
+        errfd = sys.stderr.fileno()
+
+    commands = enumerate(commands)
+    results = {}
+    running = []
+    spool = _Spool() if keep_order else None
+    next_out = 0
+    exhausted = False
+    devnull = os.open(os.devnull, os.O_RDONLY | os.O_CLOEXEC)
+    blocked = signal.pthread_sigmask(signal.SIG_BLOCK, (signal.SIGCHLD,))
+    try:
+        while True:
+            while not exhausted and len(running) < max_jobs:
+                try:
+                    index, argv = next(commands)
+                except StopIteration:
+                    exhausted = True
+                    break
+                running.append(_start(index, argv, devnull))
+            if not running:
+                break
+
+            _reap()
+            update_status()
+            done = [r for r in running if r.job.completed]
+            if not done:
+                _wait_for_child(_POLL)
+                continue
+
+            for r in done:
+                job = r.job
+                running.remove(r)
+                remove_job(job)
+                results[r.index] = Result(job.procs[0].argv, job.returncode, job.elapsed,
+                                          job.utime + job.stime)
+                if not keep_order:
+                    _emit(r, outfd, errfd)
+                elif r.index == next_out:
+                    _emit(r, outfd, errfd)
+                    next_out += 1
+                else:
+                    spool.hold(r)
+            while keep_order and next_out in spool.held:
+                spool.emit(next_out, outfd, errfd)
+                next_out += 1
+    except KeyboardInterrupt:
+        # the jobs are in their own process groups, away from the terminal's ^C
+        for r in running:
+            for proc in r.job.procs:
+                if proc.pid and not proc.completed:
+                    os.kill(proc.pid, signal.SIGINT)
+        for r in running:
+            r.job.wait()
+            remove_job(r.job)
+            _emit(r, outfd, errfd)
+        raise
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+        os.close(devnull)
+        if spool is not None:
+            spool.close()
+    return [results[i] for i in sorted(results)]
+
+
+if __name__ == '__main__':
+    import unittest
+
+    # run without job control
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+
+    class TestCase(unittest.TestCase):
+        def run_commands(self, commands, **kwargs):
+            with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+                results = run_parallel(commands, outfd=out.fileno(), errfd=err.fileno(), **kwargs)
+                out.seek(0)
+                err.seek(0)
+                return results, out.read().decode(), err.read().decode()
+
+        def test_make_commands(self):
+            self.assertEqual(list(make_commands(['echo', '-n'], 'abc', 2)),
+                             [['echo', '-n', 'a', 'b'], ['echo', '-n', 'c']])
+            self.assertEqual(list(make_commands(['mv', '{}', '{}.bak'], ['x'])),
+                             [['mv', 'x', 'x.bak']])
+
+        def test_grouped_output(self):
+            script = 'echo {0}a; sleep 0.0{0}; echo {0}b; echo {0}e >&2'
+            commands = [['sh', '-c', script.format(i)] for i in range(9, 0, -1)]
+            results, out, err = self.run_commands(commands, max_jobs=9)
+            lines = out.split()
+            self.assertEqual(len(lines), 18)
+            for i in range(0, 18, 2):
+                self.assertEqual((lines[i][0], lines[i + 1][0]), (lines[i][0], lines[i][0]))
+            # the quickest commands finish first
+            self.assertEqual(lines[0], '1a')
+            self.assertEqual(sorted(err.split()), ['{}e'.format(i) for i in range(1, 10)])
+            self.assertEqual([r.returncode for r in results], [0] * 9)
+
+        def test_keep_order(self):
+            commands = [['sh', '-c', 'sleep 0.0{0}; echo {0}'.format(i)] for i in range(5, 0, -1)]
+            results, out, err = self.run_commands(commands, max_jobs=5, keep_order=True)
+            self.assertEqual(out.split(), ['5', '4', '3', '2', '1'])
+
+        def test_keep_order_spool(self):
+            # the output of the quick commands waits in the spool, not in
+            # two open files each
+            fds = len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+            seen = []
+
+            def commands():
+                yield ['sh', '-c', 'sleep 0.3; echo first; echo e0 >&2']
+                for i in range(1, 200):
+                    if fds is not None:
+                        seen.append(len(os.listdir('/proc/self/fd')))
+                    yield ['echo', str(i)]
+
+            results, out, err = self.run_commands(commands(), max_jobs=4, keep_order=True)
+            self.assertEqual(out.split(), ['first'] + [str(i) for i in range(1, 200)])
+            self.assertEqual(err, 'e0\n')
+            if fds is not None:
+                self.assertLess(max(seen) - fds, 20)
+
+        def test_bounded(self):
+            commands = [['sleep', '0.2']] * 6
+            start = time.monotonic()
+            results, out, err = self.run_commands(commands, max_jobs=3)
+            elapsed = time.monotonic() - start
+            self.assertTrue(0.4 <= elapsed < 1.0, elapsed)
+            self.assertEqual(len(results), 6)
+
+        def test_failures(self):
+            commands = [['true'], ['false'], ['sh', '-c', 'exit 3'], ['echo', 'x']]
+            results, out, err = self.run_commands(commands, max_jobs=2)
+            self.assertEqual([r.returncode for r in results], [0, 1, 3, 0])
+            self.assertEqual(out, 'x\n')
+
+        def test_job_table(self):
+            from .job import job_count
+
+            self.run_commands([['true']] * 20, max_jobs=4)
+            self.assertEqual(job_count(), 0)
+
+    unittest.main()
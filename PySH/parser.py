@@ -1,13 +1,13 @@
-from ply import lex
-from ply import yacc
+from . import perf
 
+import os
 import re
 
 redirect_re = re.compile(r'(\d*)(>&|>>|>|<)')
 
 class IO_Redirect:
     def __init__(self, s):
-        match = redirect_re.match(s.value)
+        match = redirect_re.match(s)
         self.filename = None
         self.type = match.group(2)
         fd = match.group(1)
@@ -26,39 +26,97 @@ class IO_Redirect:
 
 tokens = 'REDIRECT DQUOTE_LITERAL SQUOTE_LITERAL AND OR WORD_LITERAL NEWLINE'.split()
 
-literals = '\\|();&'
+literals = '|();&'
+
+# One pass over the input with a single compiled pattern. Blanks and line
+# continuations are folded into the front of the next match, and '#' only
+# starts a comment where a word could start. A word that is exactly one
+# quoted string gets its own token type, any other word keeps its quotes for
+# expand_word to remove piece by piece.
+_scan_re = re.compile(r'''
+    [ \t\r\f\v]* (?:\\\n[ \t\r\f\v]*)*
+    (?:
+      (?P<REDIRECT>\d*(?:>&|>>|>|<))
+    | (?P<WORD_LITERAL>
+        (?:[^\s|;&<>()'"\\\#]|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)
+        (?:[^\s|;&<>()'"\\]|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)*)
+    | (?P<NEWLINE>\n)
+    | (?P<COMMENT>\#[^\n]*)
+    | (?P<AND>&&)
+    | (?P<OR>\|\|)
+    | (?P<LITERAL>[|();&])
+    | (?P<ERROR>.)
+    )
+''', re.VERBOSE | re.DOTALL)
+
+
+class Token:
+    __slots__ = ('type', 'value', 'lineno', 'lexpos', 'lexer')
+
+    def __init__(self, type, value, lexpos, lexer):
+        self.type = type
+        self.value = value
+        self.lexpos = lexpos
+        self.lexer = lexer
+        self.lineno = 0
 
-t_ignore_COMMENT = r'\#.*'
-
-def t_REDIRECT(t):
-    r'(\d*)(>&|>>|>|<)'
-    t.value = IO_Redirect(t)
-    return t
-
-def t_DQUOTE_LITERAL(t):
-    r'"(.*)?"'
-    t.value = t.value[1:-1]
-    return t
-
-def t_SQUOTE_LITERAL(t):
-    r"'(.*)?'"
-    t.value = t.value[1:-1]
-    return t
-
-t_AND = r'&&'
-t_OR = r'\|\|'
-
-t_WORD_LITERAL = r'[^|;&<>\s]+'
-
-t_NEWLINE = r'\n'
+    def __repr__(self):
+        return 'Token({}, {!r}, {})'.format(self.type, self.value, self.lexpos)
 
-t_ignore = ' \t'
 
-def t_error(t):
-    print("Illegal character: '{}'".format(t.value[0]))
-    t.lexer.skip(1)
+class Lexer:
+    """
+    The tokenizer for interactive and script input, with the input()/token()
+    interface yacc expects.
+    """
 
-lexer = lex.lex()
+    def __init__(self):
+        self.text = ''
+        self.__tokens = iter(())
+
+    def input(self, text):
+        self.text = text
+        if perf.enabled():
+            # tokenized up front so the time is not mixed into the parse
+            with perf.span('tokenize'):
+                self.__tokens = iter(list(self.tokenize(text)))
+        else:
+            self.__tokens = self.tokenize(text)
+
+    def token(self):
+        return next(self.__tokens, None)
+
+    def __iter__(self):
+        return self.__tokens
+
+    def line_of(self, lexpos):
+        return self.text.count('\n', 0, lexpos) + 1
+
+    def tokenize(self, text):
+        for m in _scan_re.finditer(text):
+            kind = m.lastgroup
+            value = m.group(kind)
+            pos = m.start(kind)
+            if kind == 'WORD_LITERAL':
+                quote = value[0]
+                if quote == "'" or quote == '"':
+                    if value[-1] == quote and value.count(quote) == 2 and \
+                       (quote == "'" or '\\' not in value):
+                        kind = 'SQUOTE_LITERAL' if quote == "'" else 'DQUOTE_LITERAL'
+                        value = value[1:-1]
+            elif kind == 'COMMENT':
+                continue
+            elif kind == 'LITERAL':
+                kind = value
+            elif kind == 'REDIRECT':
+                value = IO_Redirect(value)
+            elif kind == 'ERROR':
+                # only an unmatched quote or a trailing backslash get here
+                if value == '\\':
+                    raise SyntaxError('syntax error: unexpected end of input')
+                raise SyntaxError('syntax error: unterminated {} on line {}'.format(
+                    value, self.line_of(pos)))
+            yield Token(kind, value, pos, self)
 
 
 class Complete_Command:
@@ -69,6 +127,23 @@ class Complete_Command:
         return 'Complete_Command({})'.format(self.cmdlist)
 
 
+class And_Or:
+    def __init__(self, pipeline):
+        self.pipelines = [pipeline]
+        self.ops = []
+        self.background = False
+
+    def add(self, op, pipeline):
+        self.ops.append(op)
+        self.pipelines.append(pipeline)
+
+    def __repr__(self):
+        parts = [self.pipelines[0]]
+        for op, pipeline in zip(self.ops, self.pipelines[1:]):
+            parts.extend((op, pipeline))
+        return 'And_Or({}{})'.format(parts, ' &' if self.background else '')
+
+
 class Pipeline:
     def __init__(self, cmd):
         self.cmds = [cmd]
@@ -80,6 +155,14 @@ class Pipeline:
         return 'Pipeline({})'.format(self.cmds)
 
 
+class Quoted_Word(str):
+    """A double quoted word: variables expand, no splitting or globbing."""
+
+
+class Literal_Word(str):
+    """A single quoted word: used exactly as written."""
+
+
 class CommandSuffix:
     def __init__(self):
         self.args = []
@@ -100,31 +183,52 @@ class Command:
         return 'Command({} {} {})'.format(self.name, self.args, self.redirects)
 
 
+start = 'program'
+
+def p_program(p):
+    '''program : linebreak complete_commands linebreak
+               | linebreak'''
+    if len(p) > 2:
+        p[0] = Complete_Command(p[2])
+    else:
+        p[0] = Complete_Command([])
+
+def p_complete_commands(p):
+    '''complete_commands : complete_commands newline_list complete_command
+                         |                                complete_command'''
+    if len(p) == 2:
+        p[0] = p[1]
+    else:
+        p[0] = p[1]
+        p[0].extend(p[3])
+
 def p_complete_command(p):
-    '''complete_command : list separator
+    '''complete_command : list separator_op
                         | list'''
-    p[0] = Complete_Command(p[1])
+    p[0] = p[1]
     if len(p) > 2 and p[2] == '&':
-        p[0].background = True
+        p[1][-1].background = True
 
 def p_list(p):
     '''list : list separator_op and_or
             |                   and_or'''
     if len(p) == 2:
-        p[0] = p[1]
+        p[0] = [p[1]]
     else:
-        p[0] = [p[1], p[2], p[3]]
+        p[0] = p[1]
+        if p[2] == '&':
+            p[0][-1].background = True
+        p[0].append(p[3])
 
 def p_and_or(p):
     '''and_or :                      pipeline
               | and_or AND linebreak pipeline
               | and_or OR  linebreak pipeline'''
     if len(p) == 2:
-        p[0] = [p[1]]
+        p[0] = And_Or(p[1])
     else:
         p[0] = p[1]
-        p[0].append(p[2])
-        p[0].append(p[4])
+        p[0].add(p[2], p[4])
 
 def p_pipeline(p):
     '''pipeline :                        command
@@ -147,7 +251,13 @@ def p_word(p):
     '''word : WORD_LITERAL
             | DQUOTE_LITERAL
             | SQUOTE_LITERAL'''
-    p[0] = p[1]
+    kind = p.slice[1].type
+    if kind == 'DQUOTE_LITERAL':
+        p[0] = Quoted_Word(p[1])
+    elif kind == 'SQUOTE_LITERAL':
+        p[0] = Literal_Word(p[1])
+    else:
+        p[0] = p[1]
 
 def p_cmd_name(p):
     '''cmd_name : word'''
@@ -160,13 +270,13 @@ def p_cmd_suffix(p):
                   | cmd_suffix word'''
     if len(p) > 2:
         p[0] = p[1]
-        if type(p[2]) is str:
+        if isinstance(p[2], str):
             p[0].args.append(p[2])
         else:
             p[0].redirects.append(p[2])
     else:
         p[0] = CommandSuffix()
-        if type(p[1]) is str:
+        if isinstance(p[1], str):
             p[0].args.append(p[1])
         else:
             p[0].redirects.append(p[1])
@@ -191,24 +301,135 @@ def p_separator_op(p):
                     | ';' '''
     p[0] = p[1]
 
-def p_separator(p):
-    '''separator : separator_op linebreak
-                 | newline_list'''
-    if len(p) > 2:
-        p[0] = p[1]
-    else:
-        p[0] = '\n'
-
 def p_error(p):
-    print("Syntax error at '{}'".format(t.value))
-
-
-parser = yacc.yacc()
+    if p is None:
+        raise SyntaxError('syntax error: unexpected end of input')
+    raise SyntaxError("syntax error near '{}'".format(p.value))
+
+
+class Symbol:
+    __slots__ = ('type', 'value')
+
+    def __init__(self, type):
+        self.type = type
+        self.value = None
+
+
+class Production:
+    """
+    What a p_ function is called with, as in PLY: p[0] is set to the value of
+    the rule, p[1:] are the values of the symbols it matched and p.slice the
+    symbols themselves.
+    """
+
+    __slots__ = ('slice',)
+
+    def __getitem__(self, n):
+        return self.slice[n].value
+
+    def __setitem__(self, n, value):
+        self.slice[n].value = value
+
+    def __len__(self):
+        return len(self.slice)
+
+
+def _load_tables():
+    """
+    Returns the LALR action and goto tables and the productions as
+    (name, length, p_ function) from PySH/parsetab.py, without reflecting
+    over the grammar or checking its signature. If they are missing or do
+    not fit the grammar functions PLY builds them in memory; nothing is ever
+    written at import time.
+    """
+
+    global signature
+
+    try:
+        from . import parsetab
+        if parsetab._tabversion != '3.10':
+            raise ImportError('parsetab.py is from another version of PLY')
+        productions = [(name, length, func and globals()[func])
+                       for _, name, length, func, _, _ in parsetab._lr_productions]
+    except (ImportError, KeyError):
+        from ply import yacc
+
+        lr = yacc.yacc(debug=False, write_tables=False)
+        return lr.action, lr.goto, [(p.name, p.len, p.callable) for p in lr.productions]
+    signature = parsetab._lr_signature
+    return parsetab._lr_action, parsetab._lr_goto, productions
+
+def write_tables(outputdir=None):
+    """
+    Regenerates PySH/parsetab.py. Run after changing the tokens or the
+    grammar: python3 -m PySH.parser --write-tables
+    """
+
+    from ply import yacc
+
+    if outputdir is None:
+        outputdir = os.path.dirname(os.path.abspath(__file__))
+    yacc.yacc(debug=False, tabmodule='parsetab', outputdir=outputdir)
+
+def grammar_signature():
+    from ply import yacc
+
+    info = yacc.ParserReflect(globals())
+    info.get_all()
+    return info.signature()
+
+
+signature = None # of the loaded tables, None when built in memory
+lexer = Lexer()
+_action, _goto, _productions = _load_tables()
+
+
+def parse(text):
+    """
+    Runs the LALR automaton over the tokens of text, the same way PLY's
+    LRParser does but without its debugging, tracking and error recovery,
+    and returns the Complete_Command.
+    """
+
+    lexer.input(text)
+    states = [0]
+    symbols = []
+    p = Production()
+    token = lexer.token()
+    kind = token.type if token is not None else '$end'
+    while True:
+        t = _action[states[-1]].get(kind)
+        if t is None:
+            p_error(token) # raises
+        elif t > 0: # shift
+            states.append(t)
+            symbols.append(token)
+            token = lexer.token()
+            kind = token.type if token is not None else '$end'
+        elif t < 0: # reduce
+            name, length, func = _productions[-t]
+            result = Symbol(name)
+            if length:
+                p.slice = [result] + symbols[-length:]
+                del symbols[-length:]
+                del states[-length:]
+            else:
+                p.slice = [result]
+            func(p)
+            symbols.append(result)
+            states.append(_goto[states[-1]][name])
+        else: # accept
+            return symbols[-1].value
 
 
 if __name__ == '__main__':
+    import sys
     import unittest
 
+    if sys.argv[1:] == ['--write-tables']:
+        write_tables()
+        sys.exit(0)
+
     class TestCase(unittest.TestCase):
         def test_lexer1(self):
             lexer.input('''foobar -a -b arg1 arg2 "a long arg" 'another arg'>/dev/null 2>&1 &''')
@@ -250,8 +471,93 @@ if __name__ == '__main__':
             tok = next(i)
             self.assertEqual(tok.value, '&')
 
+        def test_lexer_words(self):
+            lexer.input('''a"b c"'d' "x\\"y" '' a#b # comment\n2>>x \\\n y''')
+            self.assertEqual([(t.type, t.value) for t in lexer if t.type != 'REDIRECT'], [
+                ('WORD_LITERAL', 'a"b c"\'d\''),
+                ('WORD_LITERAL', '"x\\"y"'),
+                ('SQUOTE_LITERAL', ''),
+                ('WORD_LITERAL', 'a#b'),
+                ('NEWLINE', '\n'),
+                ('WORD_LITERAL', 'x'),
+                ('WORD_LITERAL', 'y'),
+            ])
+
+        def test_lexer_error(self):
+            self.assertRaises(SyntaxError, parse, 'echo "abc')
+            self.assertRaises(SyntaxError, parse, "echo\n'abc")
+            self.assertRaises(SyntaxError, parse, 'echo abc\\')
+
         def test_parser1(self):
-            result = parser.parse('cat /foo | grep -v poop && bar || foo')
-            print('result=', result)
+            result = parse('cat /foo | grep -v poop && bar || foo')
+            self.assertEqual(len(result.cmdlist), 1)
+            and_or = result.cmdlist[0]
+            self.assertEqual(and_or.ops, ['&&', '||'])
+            self.assertEqual(len(and_or.pipelines), 3)
+            self.assertEqual([c.name for c in and_or.pipelines[0].cmds], ['cat', 'grep'])
+            self.assertEqual(and_or.pipelines[0].cmds[1].args, ['-v', 'poop'])
+            self.assertFalse(and_or.background)
+
+        def test_parser_list(self):
+            result = parse('sleep 1 & echo a; echo b &')
+            self.assertEqual([x.background for x in result.cmdlist], [True, False, True])
+
+        def test_parser_empty(self):
+            self.assertEqual(parse('').cmdlist, [])
+            self.assertEqual(parse('# just a comment').cmdlist, [])
+
+        def test_parser_error(self):
+            self.assertRaises(SyntaxError, parse, 'foo |')
+
+        def test_tables_current(self):
+            from . import parsetab
+            self.assertEqual(parsetab._lr_signature, grammar_signature(),
+                             'parsetab.py is stale, run: python3 -m PySH.parser --write-tables')
+
+        def test_import_cost(self):
+            import subprocess
+            import tempfile
+
+            pkgdir = os.path.dirname(os.path.abspath(__file__))
+            contents = lambda: sorted(x for x in os.listdir(pkgdir) if x != '__pycache__')
+            before = contents()
+            with tempfile.TemporaryDirectory() as cwd:
+                env = dict(os.environ, PYTHONPATH=os.path.dirname(pkgdir))
+                env.pop('PYTHONDONTWRITEBYTECODE', None)
+                times = []
+                for i in range(5):
+                    # a cold import, timed by the interpreter itself
+                    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import PySH.parser'],
+                                         cwd=cwd, env=env, stderr=subprocess.PIPE, check=True,
+                                         universal_newlines=True).stderr
+                    imports = {}
+                    for line in out.splitlines()[1:]:
+                        self_us, cumulative, name = line.split(':', 1)[1].split('|')
+                        imports[name.strip()] = int(self_us)
+                    self.assertNotIn('ply.yacc', imports)
+                    self.assertNotIn('inspect', imports)
+                    # the stdlib modules it needs are imported by the shell anyway
+                    times.append(sum(us for name, us in imports.items() if name.startswith('PySH')))
+                self.assertEqual(os.listdir(cwd), [])
+            self.assertEqual(contents(), before)
+            # the first run may have to byte-compile the tables
+            self.assertLess(min(times[1:]), 5000, times)
+
+        def test_fallback_tables(self):
+            # what _load_tables() falls back to gives the same parse
+            global _action, _goto, _productions
+            from ply import yacc
+
+            text = 'a | b 2>&1 && c\nd &'
+            expected = repr(parse(text))
+            saved = _action, _goto, _productions
+            lr = yacc.yacc(debug=False, write_tables=False)
+            _action, _goto = lr.action, lr.goto
+            _productions = [(p.name, p.len, p.callable) for p in lr.productions]
+            try:
+                self.assertEqual(repr(parse(text)), expected)
+                self.assertRaises(SyntaxError, parse, 'a &&')
+            finally:
+                _action, _goto, _productions = saved
 
     unittest.main()
@@ -0,0 +1,60 @@
+
+# parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = "programAND DQUOTE_LITERAL NEWLINE OR REDIRECT SQUOTE_LITERAL WORD_LITERALprogram : linebreak complete_commands linebreak\n               | linebreakcomplete_commands : complete_commands newline_list complete_command\n                         |                                complete_commandcomplete_command : list separator_op\n                        | listlist : list separator_op and_or\n            |                   and_orand_or :                      pipeline\n              | and_or AND linebreak pipeline\n              | and_or OR  linebreak pipelinepipeline :                        command\n                | pipeline '|' linebreak commandcommand : cmd_name cmd_suffix\n               | cmd_nameword : WORD_LITERAL\n            | DQUOTE_LITERAL\n            | SQUOTE_LITERALcmd_name : wordcmd_suffix :            io_redirect\n                  | cmd_suffix io_redirect\n                  |            word\n                  | cmd_suffix wordio_redirect : REDIRECT wordnewline_list :              NEWLINE\n                    | newline_list NEWLINElinebreak : newline_list\n                 | separator_op : '&'\n                    | ';' "
+    
+_lr_action_items = {'WORD_LITERAL':([0,2,3,4,11,12,13,14,15,16,18,19,20,21,22,23,24,25,26,27,28,31,32,33,34,35,36,],[-28,13,-27,-25,13,-19,-16,-17,-18,-26,13,13,-29,-30,-28,-28,-28,13,-20,-22,13,13,13,13,-21,-23,-24,]),'DQUOTE_LITERAL':([0,2,3,4,11,12,13,14,15,16,18,19,20,21,22,23,24,25,26,27,28,31,32,33,34,35,36,],[-28,14,-27,-25,14,-19,-16,-17,-18,-26,14,14,-29,-30,-28,-28,-28,14,-20,-22,14,14,14,14,-21,-23,-24,]),'SQUOTE_LITERAL':([0,2,3,4,11,12,13,14,15,16,18,19,20,21,22,23,24,25,26,27,28,31,32,33,34,35,36,],[-28,15,-27,-25,15,-19,-16,-17,-18,-26,15,15,-29,-30,-28,-28,-28,15,-20,-22,15,15,15,15,-21,-23,-24,]),'$end':([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,25,26,27,29,30,34,35,36,37,38,39,],[-28,0,-2,-27,-25,-28,-4,-6,-8,-9,-12,-15,-19,-16,-17,-18,-26,-1,-27,-5,-29,-30,-14,-20,-22,-3,-7,-21,-23,-24,-10,-11,-13,]),'NEWLINE':([0,3,4,5,6,7,8,9,10,11,12,13,14,15,16,18,19,20,21,22,23,24,25,26,27,29,30,34,35,36,37,38,39,],[4,16,-25,4,-4,-6,-8,-9,-12,-15,-19,-16,-17,-18,-26,16,-5,-29,-30,4,4,4,-14,-20,-22,-3,-7,-21,-23,-24,-10,-11,-13,]),'&':([7,8,9,10,11,12,13,14,15,25,26,27,30,34,35,36,37,38,39,],[20,-8,-9,-12,-15,-19,-16,-17,-18,-14,-20,-22,-7,-21,-23,-24,-10,-11,-13,]),';':([7,8,9,10,11,12,13,14,15,25,26,27,30,34,35,36,37,38,39,],[21,-8,-9,-12,-15,-19,-16,-17,-18,-14,-20,-22,-7,-21,-23,-24,-10,-11,-13,]),'AND':([8,9,10,11,12,13,14,15,25,26,27,30,34,35,36,37,38,39,],[22,-9,-12,-15,-19,-16,-17,-18,-14,-20,-22,22,-21,-23,-24,-10,-11,-13,]),'OR':([8,9,10,11,12,13,14,15,25,26,27,30,34,35,36,37,38,39,],[23,-9,-12,-15,-19,-16,-17,-18,-14,-20,-22,23,-21,-23,-24,-10,-11,-13,]),'|':([9,10,11,12,13,14,15,25,26,27,34,35,36,37,38,39,],[24,-12,-15,-19,-16,-17,-18,-14,-20,-22,-21,-23,-24,24,24,-13,]),'REDIRECT':([11,12,13,14,15,25,26,27,34,35,36,],[28,-19,-16,-17,-18,28,-20,-22,-21,-23,-24,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'program':([0,],[1,]),'linebreak':([0,5,22,23,24,],[2,17,31,32,33,]),'newline_list':([0,5,22,23,24,],[3,18,3,3,3,]),'complete_commands':([2,],[5,]),'complete_command':([2,18,],[6,29,]),'list':([2,18,],[7,7,]),'and_or':([2,18,19,],[8,8,30,]),'pipeline':([2,18,19,31,32,],[9,9,9,37,38,]),'command':([2,18,19,31,32,33,],[10,10,10,10,10,39,]),'cmd_name':([2,18,19,31,32,33,],[11,11,11,11,11,11,]),'word':([2,11,18,19,25,28,31,32,33,],[12,27,12,12,35,36,12,12,12,]),'separator_op':([7,],[19,]),'cmd_suffix':([11,],[25,]),'io_redirect':([11,25,],[26,34,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> program","S'",1,None,None,None),
+  ('program -> linebreak complete_commands linebreak','program',3,'p_program','parser.py',132),
+  ('program -> linebreak','program',1,'p_program','parser.py',133),
+  ('complete_commands -> complete_commands newline_list complete_command','complete_commands',3,'p_complete_commands','parser.py',140),
+  ('complete_commands -> complete_command','complete_commands',1,'p_complete_commands','parser.py',141),
+  ('complete_command -> list separator_op','complete_command',2,'p_complete_command','parser.py',149),
+  ('complete_command -> list','complete_command',1,'p_complete_command','parser.py',150),
+  ('list -> list separator_op and_or','list',3,'p_list','parser.py',156),
+  ('list -> and_or','list',1,'p_list','parser.py',157),
+  ('and_or -> pipeline','and_or',1,'p_and_or','parser.py',167),
+  ('and_or -> and_or AND linebreak pipeline','and_or',4,'p_and_or','parser.py',168),
+  ('and_or -> and_or OR linebreak pipeline','and_or',4,'p_and_or','parser.py',169),
+  ('pipeline -> command','pipeline',1,'p_pipeline','parser.py',177),
+  ('pipeline -> pipeline | linebreak command','pipeline',4,'p_pipeline','parser.py',178),
+  ('command -> cmd_name cmd_suffix','command',2,'p_command','parser.py',186),
+  ('command -> cmd_name','command',1,'p_command','parser.py',187),
+  ('word -> WORD_LITERAL','word',1,'p_word','parser.py',194),
+  ('word -> DQUOTE_LITERAL','word',1,'p_word','parser.py',195),
+  ('word -> SQUOTE_LITERAL','word',1,'p_word','parser.py',196),
+  ('cmd_name -> word','cmd_name',1,'p_cmd_name','parser.py',206),
+  ('cmd_suffix -> io_redirect','cmd_suffix',1,'p_cmd_suffix','parser.py',210),
+  ('cmd_suffix -> cmd_suffix io_redirect','cmd_suffix',2,'p_cmd_suffix','parser.py',211),
+  ('cmd_suffix -> word','cmd_suffix',1,'p_cmd_suffix','parser.py',212),
+  ('cmd_suffix -> cmd_suffix word','cmd_suffix',2,'p_cmd_suffix','parser.py',213),
+  ('io_redirect -> REDIRECT word','io_redirect',2,'p_io_redirect','parser.py',228),
+  ('newline_list -> NEWLINE','newline_list',1,'p_newline_list','parser.py',233),
+  ('newline_list -> newline_list NEWLINE','newline_list',2,'p_newline_list','parser.py',234),
+  ('linebreak -> newline_list','linebreak',1,'p_linebreak','parser.py',238),
+  ('linebreak -> <empty>','linebreak',0,'p_linebreak','parser.py',239),
+  ('separator_op -> &','separator_op',1,'p_separator_op','parser.py',243),
+  ('separator_op -> ;','separator_op',1,'p_separator_op','parser.py',244),
+]
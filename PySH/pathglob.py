@@ -0,0 +1,345 @@
+"""
+Pathname and brace expansion.
+
+Words without glob metacharacters never touch the filesystem. Patterns are
+compiled once per path segment and matched against os.scandir listings that
+are cached per directory and revalidated by the directory's mtime, so
+expanding the same directory again costs one stat instead of a listing.
+
+A '**' segment matches any number of directories. That walk fans out over a
+thread pool, one os.scandir per directory using the DirEntry type info, so
+no extra stat calls are made; it does not follow symlinks or enter dot
+directories. Matches are counted as they arrive and the walk is abandoned
+once there are more than GLOBSTAR_MAX of them. Only the first '**' in a
+pattern recurses, later ones match like '*'.
+"""
+
+import fnmatch
+import functools
+import os
+import re
+
+
+LISTING_CACHE_SIZE = 256
+GLOBSTAR_THREADS = min(32, (os.cpu_count() or 1) + 4)
+GLOBSTAR_MAX = 100000 # 0 for no limit
+
+_magic_re = re.compile(r'[*?[]')
+_escape_re = re.compile(r'([*?[])')
+_sequence_re = re.compile(r'^(-?\d+|[A-Za-z])\.\.(-?\d+|[A-Za-z])(?:\.\.(-?\d+))?$')
+
+_EMPTY = ((), frozenset())
+_listings = {}  # absolute dir -> (st_mtime_ns, sorted names, frozenset of dir names)
+
+
+class Glob_Limit_Error(Exception):
+    def __init__(self, pattern, limit):
+        super().__init__('{}: more than {} matches'.format(pattern, limit))
+
+
+def has_magic(s):
+    return _magic_re.search(s) is not None
+
+def escape(s):
+    return _escape_re.sub(r'[\1]', s)
+
+@functools.lru_cache(maxsize=256)
+def _compile(segment):
+    return re.compile(fnmatch.translate(segment)).match
+
+def listing(d):
+    """
+    Returns (sorted names, frozenset of directory names) for the directory
+    d, or empty ones if it cannot be read.
+    """
+
+    key = os.path.abspath(d)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except OSError:
+        return _EMPTY
+    entry = _listings.get(key)
+    if entry is None or entry[0] != mtime:
+        names = []
+        dirs = set()
+        try:
+            with os.scandir(key) as it:
+                for e in it:
+                    names.append(e.name)
+                    try:
+                        if e.is_dir():
+                            dirs.add(e.name)
+                    except OSError:
+                        pass
+        except OSError:
+            return _EMPTY
+        names.sort()
+        if len(_listings) >= LISTING_CACHE_SIZE:
+            del _listings[next(iter(_listings))]
+        entry = _listings[key] = (mtime, tuple(names), frozenset(dirs))
+    return entry[1], entry[2]
+
+def clear_cache():
+    _listings.clear()
+
+def _join(base, name):
+    if not base:
+        return name
+    if base.endswith('/'):
+        return base + name
+    return base + '/' + name
+
+def _scan(d):
+    # an uncached listing that is safe to call from the globstar threads;
+    # subdirs excludes symlinks and dot directories
+    names = []
+    dirs = set()
+    subdirs = []
+    try:
+        with os.scandir(d) as it:
+            for e in it:
+                names.append(e.name)
+                try:
+                    if e.is_dir():
+                        dirs.add(e.name)
+                        if e.name[0] != '.' and not e.is_symlink():
+                            subdirs.append(e.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return (names, frozenset(dirs)), subdirs
+
+def _match_segment(bases, segment, dirs_only, listing=listing):
+    result = []
+    if has_magic(segment):
+        match = _compile(segment)
+        hidden = segment.startswith('.')
+        for base in bases:
+            names, dirs = listing(base or '.')
+            for name in (names if not dirs_only else [x for x in names if x in dirs]):
+                if match(name) and (hidden or name[0] != '.'):
+                    result.append(_join(base, name))
+    elif segment in ('.', '..'):
+        result = [_join(base, segment) for base in bases]
+    else:
+        for base in bases:
+            names, dirs = listing(base or '.')
+            if segment in (dirs if dirs_only else names):
+                result.append(_join(base, segment))
+    return result
+
+def glob(pattern):
+    """
+    Returns the sorted paths matching pattern. Like the shell, '*' and '?'
+    do not match a leading '.' and a trailing '/' only matches directories.
+    """
+
+    segments = [x for x in pattern.split('/') if x]
+    bases = ['/' if pattern.startswith('/') else '']
+    trailing = pattern.endswith('/')
+    for i, segment in enumerate(segments):
+        if segment == '**':
+            rest = segments[i + 1:]
+            while rest and rest[0] == '**':
+                del rest[0]
+            return sorted(_globstar(pattern, bases, rest, trailing))
+        last = i == len(segments) - 1
+        bases = _match_segment(bases, segment, not last or trailing)
+        if not bases:
+            return []
+    if trailing:
+        bases = [x + '/' for x in bases]
+    return sorted(bases)
+
+def _walk_one(base, rest, trailing):
+    # scans one directory of a globstar walk, returns (subdirs, matches)
+    names, subdirs = _scan(base or '.')
+    subdirs = [_join(base, x) for x in subdirs]
+    if not rest:
+        # a final '**' matches every file and directory below
+        found = names[1] if trailing else names[0]
+        return subdirs, [_join(base, x) + ('/' if trailing else '') for x in found if x[0] != '.']
+
+    cached = {base or '.': names}
+    matches = _match_segment([base], rest[0], len(rest) > 1 or trailing,
+                             listing=lambda d: cached.get(d) or _scan(d)[0])
+    for i, segment in enumerate(rest[1:], 2):
+        if not matches:
+            break
+        matches = _match_segment(matches, segment, i < len(rest) or trailing,
+                                 listing=lambda d: _scan(d)[0])
+    if trailing:
+        matches = [x + '/' for x in matches]
+    return subdirs, matches
+
+def _globstar(pattern, bases, rest, trailing):
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    result = []
+    with ThreadPoolExecutor(max_workers=GLOBSTAR_THREADS) as pool:
+        pending = set(pool.submit(_walk_one, base, rest, trailing) for base in bases)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, matches = future.result()
+                result.extend(matches)
+                if GLOBSTAR_MAX and len(result) > GLOBSTAR_MAX:
+                    for f in pending:
+                        f.cancel()
+                    raise Glob_Limit_Error(pattern, GLOBSTAR_MAX)
+                for d in subdirs:
+                    pending.add(pool.submit(_walk_one, d, rest, trailing))
+    return result
+
+def _skip_quoted(word, i):
+    # i is at an opening quote, returns the index after its closing quote
+    quote = word[i]
+    i += 1
+    while i < len(word):
+        c = word[i]
+        if c == quote:
+            return i + 1
+        if c == '\\' and quote == '"':
+            i += 1
+        i += 1
+    return i
+
+def _braces(word):
+    # yields (start, end, commas) for each unquoted {...} pair
+    stack = []
+    i = 0
+    n = len(word)
+    while i < n:
+        c = word[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == "'" or c == '"':
+            i = _skip_quoted(word, i)
+            continue
+        if c == '$' and word.startswith('{', i + 1):
+            end = word.find('}', i)
+            i = n if end < 0 else end + 1
+            continue
+        if c == '{':
+            stack.append((i, []))
+        elif c == ',' and stack:
+            stack[-1][1].append(i)
+        elif c == '}' and stack:
+            start, commas = stack.pop()
+            yield start, i, commas
+        i += 1
+
+def _sequence(text):
+    m = _sequence_re.match(text)
+    if m is None:
+        return None
+    first, last, step = m.groups()
+    step = abs(int(step)) if step else 1
+    if step == 0:
+        step = 1
+    if first.isalpha() != last.isalpha():
+        return None
+    if first.isalpha():
+        first, last, fmt = ord(first), ord(last), chr
+    else:
+        first, last, fmt = int(first), int(last), str
+    if first > last:
+        step = -step
+    return [fmt(x) for x in range(first, last + (1 if step > 0 else -1), step)]
+
+def brace_expand(word):
+    """
+    Expands a{b,c}d to abd acd and {1..3} to 1 2 3, outermost braces
+    first. Quoted braces, ${...} and braces without a ',' or '..' are left
+    alone.
+    """
+
+    if '{' not in word:
+        return [word]
+    best = None
+    for start, end, commas in _braces(word):
+        if best is not None and start > best[0]:
+            continue
+        if commas:
+            bounds = [start] + commas + [end]
+            alternatives = [word[a + 1:b] for a, b in zip(bounds, bounds[1:])]
+        else:
+            alternatives = _sequence(word[start + 1:end])
+            if alternatives is None:
+                continue
+        best = (start, end, alternatives)
+    if best is None:
+        return [word]
+    start, end, alternatives = best
+    result = []
+    for alternative in alternatives:
+        result.extend(brace_expand(word[:start] + alternative + word[end + 1:]))
+    return result
+
+
+if __name__ == '__main__':
+    import tempfile
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.cwd = os.getcwd()
+            os.chdir(self.tmp.name)
+            for name in ('a1', 'a2', 'b1', '.hidden', 'a*', 'dir/x.py', 'dir/y.txt', 'dir/sub/z.py'):
+                os.makedirs(os.path.dirname(name) or '.', exist_ok=True)
+                open(name, 'w').close()
+            clear_cache()
+
+        def tearDown(self):
+            os.chdir(self.cwd)
+            self.tmp.cleanup()
+
+        def test_glob(self):
+            self.assertEqual(glob('a?'), ['a*', 'a1', 'a2'])
+            self.assertEqual(glob('a[*]'), ['a*'])
+            self.assertEqual(glob('*/*.py'), ['dir/x.py'])
+            self.assertEqual(glob('*/'), ['dir/'])
+            self.assertEqual(glob('.h*'), ['.hidden'])
+            self.assertEqual(glob('dir/*/z.py'), ['dir/sub/z.py'])
+            self.assertEqual(glob('dir/nope/*'), [])
+            self.assertEqual(glob(self.tmp.name + '/b*'), [self.tmp.name + '/b1'])
+            self.assertEqual(glob(escape('a*')), ['a*'])
+
+        def test_listing_cache(self):
+            self.assertEqual(glob('b*'), ['b1'])
+            self.assertEqual(len(_listings), 1)
+            open('b2', 'w').close()
+            os.utime('.', ns=(0, 0)) # a new mtime even on coarse filesystems
+            self.assertEqual(glob('b*'), ['b1', 'b2'])
+
+        def test_globstar(self):
+            global GLOBSTAR_MAX
+
+            os.makedirs('dir/.git/objects')
+            open('dir/.git/objects/o.py', 'w').close()
+            os.symlink('dir', 'link')
+            self.assertEqual(glob('**/*.py'), ['dir/sub/z.py', 'dir/x.py'])
+            self.assertEqual(glob('**/sub/*.py'), ['dir/sub/z.py'])
+            self.assertEqual(glob('dir/**'), ['dir/sub', 'dir/sub/z.py', 'dir/x.py', 'dir/y.txt'])
+            self.assertEqual(glob('**/'), ['dir/', 'dir/sub/', 'link/'])
+            saved = GLOBSTAR_MAX
+            GLOBSTAR_MAX = 1
+            try:
+                self.assertRaises(Glob_Limit_Error, glob, '**/*.py')
+            finally:
+                GLOBSTAR_MAX = saved
+
+        def test_brace_expand(self):
+            self.assertEqual(brace_expand('a{b,c}d'), ['abd', 'acd'])
+            self.assertEqual(brace_expand('{a,b{c,d}}'), ['a', 'bc', 'bd'])
+            self.assertEqual(brace_expand('{x{a,b}}'), ['{xa}', '{xb}'])
+            self.assertEqual(brace_expand('{1..3}'), ['1', '2', '3'])
+            self.assertEqual(brace_expand('{c..a}'), ['c', 'b', 'a'])
+            self.assertEqual(brace_expand('{0..10..5}'), ['0', '5', '10'])
+            self.assertEqual(brace_expand('${X}{}{a}'), ['${X}{}{a}'])
+            self.assertEqual(brace_expand('"{a,b}"{1,2}'), ['"{a,b}"1', '"{a,b}"2'])
+
+    unittest.main()
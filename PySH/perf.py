@@ -0,0 +1,197 @@
+"""
+Hot-path profiler, enabled with 'set enable profile'
+
+Times the phases of every command (parse and tokenize, expand, glob,
+create_proc, spawn or fork, wait) into a ring buffer holding the last
+RING_SIZE samples. The stats builtin summarizes them (count, p50, p99, max)
+and exports them as JSON or as a Chrome trace for chrome://tracing and
+Perfetto. When disabled, span() costs a single global lookup, like
+startup.step().
+"""
+
+import _thread
+import collections
+import os
+import time
+
+
+RING_SIZE = 65536
+
+_ring = None  # deque of (phase, start ns, duration ns, thread id) while enabled
+
+
+class _Null_Span:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excval, tb):
+        return False
+
+_null_span = _Null_Span()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exctype, excval, tb):
+        end = time.perf_counter_ns()
+        if _ring is not None:
+            _ring.append((self.name, self.start, end - self.start, _thread.get_ident()))
+        return False
+
+
+def enable(size=None):
+    global _ring
+
+    if _ring is None or (size and size != _ring.maxlen):
+        _ring = collections.deque(_ring or (), maxlen=size or RING_SIZE)
+
+def disable():
+    """Stops collecting; the samples are dropped."""
+
+    global _ring
+
+    _ring = None
+
+def enabled():
+    return _ring is not None
+
+def span(name):
+    if _ring is None:
+        return _null_span
+    return _Span(name)
+
+def clear():
+    if _ring is not None:
+        _ring.clear()
+
+def samples():
+    return list(_ring or ())
+
+def _percentile(ordered, p):
+    # nearest rank
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+def stats():
+    """
+    Returns {phase: {'count', 'total', 'p50', 'p99', 'max'}}, times in
+    seconds, for the samples in the ring buffer.
+    """
+
+    durations = collections.defaultdict(list)
+    for name, start, duration, tid in samples():
+        durations[name].append(duration)
+    result = {}
+    for name, values in durations.items():
+        values.sort()
+        result[name] = {'count': len(values), 'total': sum(values) / 1e9,
+                        'p50': _percentile(values, 50) / 1e9, 'p99': _percentile(values, 99) / 1e9,
+                        'max': values[-1] / 1e9}
+    return result
+
+def report(file):
+    table = stats()
+    print('{:<12} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'phase', 'count', 'p50 us', 'p99 us', 'max us', 'total ms'), file=file)
+    for name, s in sorted(table.items(), key=lambda item: -item[1]['total']):
+        print('{:<12} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.2f}'.format(
+            name, s['count'], s['p50'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6, s['total'] * 1e3),
+            file=file)
+
+def export_json(f):
+    import json
+
+    json.dump({'stats': stats(),
+               'samples': [{'phase': name, 'start_ns': start, 'duration_ns': duration, 'tid': tid}
+                           for name, start, duration, tid in samples()]}, f)
+
+def export_chrome(f):
+    """Writes the samples in the Chrome trace event format, as complete events."""
+
+    import json
+
+    pid = os.getpid()
+    json.dump({'traceEvents': [{'name': name, 'cat': 'pysh', 'ph': 'X', 'pid': pid, 'tid': tid,
+                                'ts': start / 1e3, 'dur': duration / 1e3}
+                               for name, start, duration, tid in samples()],
+               'displayTimeUnit': 'ms'}, f)
+
+
+if __name__ == '__main__':
+    import io
+    import json
+    import unittest
+
+    # run without job control
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+
+    class TestCase(unittest.TestCase):
+        def tearDown(self):
+            disable()
+
+        def test_disabled(self):
+            self.assertIs(span('expand'), _null_span)
+            with span('expand'):
+                pass
+            self.assertEqual(samples(), [])
+
+        def test_ring(self):
+            enable(size=4)
+            for i in range(10):
+                with span(str(i)):
+                    pass
+            self.assertEqual([s[0] for s in samples()], ['6', '7', '8', '9'])
+            enable(size=8)
+            self.assertEqual(len(samples()), 4)
+
+        def test_stats(self):
+            enable()
+            _ring.extend(('wait', 0, d * 1000, 1) for d in range(1, 101))
+            s = stats()['wait']
+            self.assertEqual((s['count'], s['p50'], s['p99'], s['max']), (100, 50e-6, 99e-6, 100e-6))
+            out = io.StringIO()
+            report(out)
+            self.assertIn('wait', out.getvalue())
+
+        def test_phases(self):
+            from . import perf # the module the shell uses, not __main__
+            from .cmd import parse_command, clear_parse_cache
+
+            perf.enable()
+            try:
+                clear_parse_cache()
+                parse_command('echo *.py | cat > /dev/null').run()
+                phases = set(name for name, start, duration, tid in perf.samples())
+                self.assertTrue({'parse', 'tokenize', 'expand', 'glob', 'create_proc', 'wait'} <= phases,
+                                phases)
+                self.assertTrue(phases & {'spawn', 'fork'})
+
+                trace = io.StringIO()
+                perf.export_chrome(trace)
+                events = json.loads(trace.getvalue())['traceEvents']
+                self.assertEqual(set(e['ph'] for e in events), {'X'})
+                dump = io.StringIO()
+                perf.export_json(dump)
+                self.assertIn('expand', json.loads(dump.getvalue())['stats'])
+            finally:
+                perf.disable()
+
+        def test_overhead(self):
+            # disabled, a span is one global lookup and a no-op with block
+            def spans(n):
+                for i in range(n):
+                    with span('x'):
+                        pass
+            start = time.perf_counter()
+            spans(100000)
+            per_span = (time.perf_counter() - start) / 100000
+            self.assertLess(per_span, 2e-6)
+
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Pipes between pipeline stages and zero-copy forwarding.
+
+Pipes are created close-on-exec (spawned children get them through dup2
+file actions only) and, when a size is set globally with the pipesize
+builtin or per Job, grown with F_SETPIPE_SZ so large transfers need fewer
+context switches. copy_fd() moves data between fds in the kernel: splice
+when either side is a pipe, sendfile from regular files, and a read/write
+loop otherwise.
+"""
+
+import errno
+import os
+import stat
+
+
+PIPE_SIZE = 0  # bytes, 0 for the system default (64 KiB on Linux)
+COPY_SIZE = 1 << 20
+
+
+def make_pipe(size=0):
+    if hasattr(os, 'pipe2'):
+        rfd, wfd = os.pipe2(os.O_CLOEXEC)
+    else:
+        rfd, wfd = os.pipe() # not inheritable either
+    size = size or PIPE_SIZE
+    if size:
+        try:
+            import fcntl
+            fcntl.fcntl(wfd, fcntl.F_SETPIPE_SZ, size)
+        except (ImportError, AttributeError, OSError):
+            pass # not Linux, or above /proc/sys/fs/pipe-max-size
+    return rfd, wfd
+
+def pipe_size(fd):
+    try:
+        import fcntl
+        return fcntl.fcntl(fd, fcntl.F_GETPIPE_SZ)
+    except (ImportError, AttributeError, OSError):
+        return None
+
+def parse_size(text):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    multiplier = units.get(text[-1:].upper(), 1)
+    if multiplier != 1:
+        text = text[:-1]
+    if not text.isdigit():
+        raise ValueError('invalid size: {}'.format(text))
+    return int(text) * multiplier
+
+def _splice(infd, outfd):
+    total = 0
+    while True:
+        n = os.splice(infd, outfd, COPY_SIZE, flags=os.SPLICE_F_MOVE | os.SPLICE_F_MORE)
+        if n == 0:
+            return total
+        total += n
+
+def _sendfile(infd, outfd):
+    total = 0
+    while True:
+        n = os.sendfile(outfd, infd, None, COPY_SIZE)
+        if n == 0:
+            return total
+        total += n
+
+def _readwrite(infd, outfd):
+    total = 0
+    while True:
+        data = os.read(infd, COPY_SIZE)
+        if not data:
+            return total
+        view = memoryview(data)
+        while view:
+            n = os.write(outfd, view)
+            view = view[n:]
+        total += len(data)
+
+def copy_fd(infd, outfd):
+    """Copies everything from infd to outfd, returning the number of bytes."""
+
+    in_mode = os.fstat(infd).st_mode
+    out_mode = os.fstat(outfd).st_mode
+    copiers = []
+    if hasattr(os, 'splice') and (stat.S_ISFIFO(in_mode) or stat.S_ISFIFO(out_mode)):
+        copiers.append(_splice)
+    if hasattr(os, 'sendfile') and stat.S_ISREG(in_mode):
+        copiers.append(_sendfile)
+
+    total = 0
+    for copier in copiers:
+        try:
+            return total + copier(infd, outfd)
+        except OSError as e:
+            # unsupported for these files, the data copied so far is kept
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+    return total + _readwrite(infd, outfd)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import threading
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def copy_through(self, infd, size):
+            rfd, wfd = make_pipe()
+            out = []
+            reader = threading.Thread(target=lambda: out.append(b''.join(iter(lambda: os.read(rfd, 65536), b''))))
+            reader.start()
+            try:
+                self.assertEqual(copy_fd(infd, wfd), size)
+            finally:
+                os.close(wfd)
+            reader.join()
+            os.close(rfd)
+            return out[0]
+
+        def test_file_to_pipe(self):
+            data = os.urandom(300000)
+            with tempfile.TemporaryFile() as f:
+                f.write(data)
+                f.seek(0)
+                self.assertEqual(self.copy_through(f.fileno(), len(data)), data)
+
+        def test_pipe_to_pipe(self):
+            data = os.urandom(300000)
+            rfd, wfd = make_pipe()
+            writer = threading.Thread(target=lambda: (os.write(wfd, data), os.close(wfd)))
+            writer.start()
+            self.assertEqual(self.copy_through(rfd, len(data)), data)
+            writer.join()
+            os.close(rfd)
+
+        def test_pipe_size(self):
+            rfd, wfd = make_pipe(1 << 20)
+            try:
+                self.assertFalse(os.get_inheritable(rfd))
+                size = pipe_size(wfd)
+                if size is not None:
+                    self.assertEqual(size, 1 << 20)
+            finally:
+                os.close(rfd)
+                os.close(wfd)
+
+        def test_parse_size(self):
+            self.assertEqual(parse_size('1M'), 1 << 20)
+            self.assertEqual(parse_size('4096'), 4096)
+            self.assertRaises(ValueError, parse_size, 'big')
+
+    unittest.main()
@@ -1,28 +1,147 @@
+from . import perf
+from .cmdhash import find_command
 from .signals import *
 from .term import Terminal
 
+import _thread
+import abc
 import os
 import sys
+import time
 
 
 _terminal = Terminal()
 
+# external commands are started with posix_spawn where the platform has it;
+# processes that run Python code in the child (needs_fork) always fork
+use_spawn = hasattr(os, 'posix_spawn')
+
+# ru_maxrss is in bytes on macOS and in KiB everywhere else
+_MAXRSS_DIVISOR = 1024 if sys.platform == 'darwin' else 1
+
+
+_waiters = {}  # Process or Job -> [asyncio futures]
+_threads = {}  # Thread_Process -> its running threading.Thread
+_fds_lock = _thread.allocate_lock()  # held while a stage closes its fds and across fork()
+
+
+def exit_status(code):
+    return (code & 0xff) << 8
+
+def flush_output():
+    # what the shell itself printed goes out before anything a child writes
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+def wake_waiters(obj):
+    for fut in _waiters.pop(obj, ()):
+        if not fut.done():
+            fut.set_result(obj.returncode)
+
+def forget_threads():
+    """
+    In a forked child, where the stage threads do not exist: closes the fds
+    they still held at the fork, which would keep their pipes open.
+    """
+
+    for proc in _threads:
+        for fd in proc.fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+    _threads.clear()
+
+async def wait_for(obj):
+    """
+    Waits until obj (a Process or a Job) stops or completes, returning its
+    returncode. Requires the reaper from job.install_async_reaper().
+    """
+
+    import asyncio
+
+    while not (obj.stopped or obj.completed):
+        fut = asyncio.get_running_loop().create_future()
+        _waiters.setdefault(obj, []).append(fut)
+        await fut
+    return obj.returncode
+
 
 class Process:
-    __slots__ = ('argv', 'pid', 'completed', 'stopped', 'status', 'term_signal')
+    __slots__ = ('argv', 'path', 'job', 'pid', 'completed', 'stopped', 'status', 'term_signal',
+                 'redirects', 'start', 'end', 'utime', 'stime', 'maxrss')
+
+    needs_fork = False
 
     def __init__(self, argv):
         self.argv = argv
+        self.path = None
+        self.job = None
         self.pid = None
         self.completed = False
         self.stopped = False
         self.status = None
         self.term_signal = None
+        self.redirects = () # (fd, kind, target) from the command line
+        self.start = None   # time.monotonic() at launch and completion
+        self.end = None
+        self.utime = 0.0    # CPU seconds, from the rusage of wait4()
+        self.stime = 0.0
+        self.maxrss = None  # KiB, None unless known to be its own (see mark_status)
+
+    def launch(self, pgid, fds, fg):
+        """
+        Starts the process with fds, a dict of child fd -> shell fd (None to
+        close it), and returns its pid, or None if nothing was forked.
+        """
+
+        if self.needs_fork:
+            return self._fork(pgid, fds, fg)
+
+        self.path = find_command(self.argv[0])
+        if self.path is None:
+            print('pysh: {}: command not found'.format(self.argv[0]), file=sys.stderr)
+            self.mark_status(exit_status(127))
+            return None
+
+        if use_spawn:
+            return self._spawn(pgid, fds, fg)
+        return self._fork(pgid, fds, fg)
 
-    def launch(self, pgid, infile, outfile, errfile, fg):
-        # TODO exception handling
+    def _spawn(self, pgid, fds, fg):
+        file_actions = []
+        for target, fd in sorted(fds.items()):
+            if fd is None:
+                file_actions.append((os.POSIX_SPAWN_CLOSE, target))
+            elif fd != target:
+                file_actions.append((os.POSIX_SPAWN_DUP2, fd, target))
 
-        pid = os.fork()
+        flush_output()
+        kwargs = {'file_actions': file_actions}
+        if _terminal.interactive:
+            kwargs['setpgroup'] = pgid
+            kwargs['setsigdef'] = JOB_CONTROL_SIGNALS + (SIGPIPE,)
+        else:
+            kwargs['setsigdef'] = (SIGPIPE,)
+
+        try:
+            with perf.span('spawn'):
+                pid = os.posix_spawn(self.path, self.argv, os.environ, **kwargs)
+        except OSError as e:
+            print('pysh: {}: {}'.format(self.argv[0], str(e)), file=sys.stderr)
+            self.mark_status(exit_status(127))
+            return None
+        if _terminal.interactive:
+            # the child may already be running and stop on SIGTTIN or
+            # SIGTTOU before its group has the terminal, Job.wait()
+            # continues it once it does
+            self._join_group(pid, pgid, fg)
+        return pid
+
+    def _fork(self, pgid, fds, fg):
+        flush_output() # or the child writes the buffered output again
+        with perf.span('fork'), _fds_lock:
+            pid = os.fork()
         
         if pid == 0:
             if _terminal.interactive:
@@ -33,29 +152,212 @@ class Process:
                 if fg:
                    _terminal.grab_control(pgid)
                 default_signals()
-            if infile != sys.stdin.fileno():
-                os.dup2(infile, sys.stdin.fileno())
-            if outfile != sys.stdout.fileno():
-                os.dup2(outfile, sys.stdout.fileno())
-            if errfile != sys.stderr.fileno():
-                os.dup2(errfile, sys.stderr.fileno())
+            else:
+                signal(SIGPIPE, SIG_DFL)
+            from .job import forget_jobs
+            forget_jobs()
+
+            # no source fd is also a target (see redirect.py), so the
+            # order of the dup2 calls does not matter
+            for target, fd in fds.items():
+                if fd is None:
+                    try:
+                        os.close(target)
+                    except OSError:
+                        pass
+                elif fd != target:
+                    os.dup2(fd, target)
 
+            status = 127
             try:
-                self._launch()
+                status = self._launch()
             except Exception as e:
                 print('pysh: {}: {}'.format(self.argv[0], str(e)), file=sys.stderr)
-            sys.exit(127)
+            flush_output()
+            os._exit(status or 0)
+
+        if _terminal.interactive:
+            # the same as the child does, whichever runs first
+            self._join_group(pid, pgid, fg)
         return pid
 
+    def _join_group(self, pid, pgid, fg):
+        """
+        Puts the child in its job's process group from the shell side and
+        gives a foreground group the terminal, so both are done before the
+        next stage is started.
+        """
+
+        pgid = pgid or pid
+        try:
+            os.setpgid(pid, pgid)
+        except PermissionError:
+            pass # already exec'd, after doing it itself
+        if fg:
+            _terminal.grab_control(pgid)
+
     def _launch(self):
-        os.execvp(self.argv[0], self.argv)
+        os.execv(self.path, self.argv)
+
+    async def wait_async(self):
+        return await wait_for(self)
+
+    @property
+    def returncode(self):
+        if self.status is None:
+            return None
+        if os.WIFSTOPPED(self.status):
+            return 128 + os.WSTOPSIG(self.status)
+        if os.WIFSIGNALED(self.status):
+            return 128 + os.WTERMSIG(self.status)
+        return os.WEXITSTATUS(self.status)
+
+    @property
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return (self.end or time.monotonic()) - self.start
+
+    def usage(self):
+        return {'pid': self.pid, 'argv': self.argv, 'returncode': self.returncode,
+                'elapsed': self.elapsed, 'utime': self.utime, 'stime': self.stime,
+                'maxrss': self.maxrss}
+
+    def mark_status(self, status, rusage=None, when=None):
+        """
+        Records a wait status and, for a child reaped with wait4(), its
+        rusage and the time it was collected.
+        """
 
-    def mark_status(self, status):
         self.status = status
+        job = self.job
         if os.WIFSTOPPED(status):
+            if not self.stopped and not self.completed and job is not None:
+                job.nstopped += 1
             self.stopped = True
-        else:
+        elif not self.completed:
+            if job is not None:
+                job.ncompleted += 1
+                if self.stopped:
+                    job.nstopped -= 1
+            self.stopped = False
             self.completed = True
+            if self.end is None:
+                self.end = when or time.monotonic()
+            if rusage is not None:
+                self.utime = rusage.ru_utime
+                self.stime = rusage.ru_stime
+                # a child is charged the peak RSS of the shell it was forked
+                # or vfork()ed from, so only a peak above that is its own
+                maxrss = rusage.ru_maxrss // _MAXRSS_DIVISOR
+                if maxrss > _shell_maxrss():
+                    self.maxrss = maxrss
             if os.WIFSIGNALED(status):
                 self.term_signal = os.WTERMSIG(status)
 
+
+def _shell_maxrss():
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // _MAXRSS_DIVISOR
+
+def _thread_rusage():
+    import resource
+
+    if not hasattr(resource, 'RUSAGE_THREAD'): # Linux only
+        return None
+    return resource.getrusage(resource.RUSAGE_THREAD)
+
+
+class Thread_Process(Process, metaclass=abc.ABCMeta):
+    """
+    A pipeline stage that runs Python code in the shell process on a worker
+    thread instead of forking. It reads and writes its own copies of the
+    pipe fds given to launch() and has no pid; job.update_status() collects
+    its status once the thread is done.
+    """
+
+    __slots__ = ('result', 'fds')
+
+    def __init__(self, argv):
+        super().__init__(argv)
+        self.result = None
+        self.fds = ()  # the stage's own fds until it closes them
+
+    def launch(self, pgid, fds, fg):
+        import threading
+        from . import threadio
+
+        threadio.install()
+        # the job closes its pipe fds as soon as launch returns
+        args = self._dup_fds(fds)
+        thread = threading.Thread(target=self._thread_main, args=args,
+                                  name=self.argv[0], daemon=True)
+        _threads[self] = thread
+        thread.start()
+        return None
+
+    def _dup_fds(self, fds):
+        self.fds = [os.dup(fds[fd]) if fds.get(fd) is not None else
+                    os.open(os.devnull, os.O_RDWR | os.O_CLOEXEC) for fd in (0, 1, 2)]
+        return self.fds
+
+    def _thread_main(self, infd, outfd, errfd):
+        before = _thread_rusage()
+        status = exit_status(1)
+        try:
+            status = self._run_redirected(infd, outfd, errfd)
+        except EOFError:
+            status = exit_status(0)
+        finally:
+            # collected later by update_status(), so record the end now
+            self.end = time.monotonic()
+            after = _thread_rusage()
+            if after is not None:
+                self.utime = after.ru_utime - before.ru_utime
+                self.stime = after.ru_stime - before.ru_stime
+            self.result = status
+
+    def _run_redirected(self, infd, outfd, errfd):
+        """
+        Runs the stage in the current thread with sys.stdin/stdout/stderr
+        on the given fds, which it closes, and returns its wait status.
+        """
+
+        from . import threadio
+
+        threadio.install()
+        files = (open(infd, 'r', errors='surrogateescape'),
+                 open(outfd, 'w', errors='surrogateescape'),
+                 open(errfd, 'w', errors='surrogateescape', buffering=1))
+        status = exit_status(1)
+        try:
+            with threadio.redirect(*files):
+                try:
+                    status = exit_status(self._run() or 0)
+                except BrokenPipeError:
+                    status = SIGPIPE # as if killed by it, like an external command
+                except SystemExit as e:
+                    # sys.exit() leaves the stage, not the shell
+                    code = e.code
+                    if code is not None and not isinstance(code, int):
+                        print(code, file=sys.stderr)
+                        code = 1
+                    status = exit_status(code or 0)
+                except EOFError:
+                    raise
+                except Exception as e:
+                    print('pysh: {}: {}'.format(self.argv[0], str(e)), file=sys.stderr)
+        finally:
+            with _fds_lock:
+                for f in files:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                self.fds = ()
+        return status
+
+    @abc.abstractmethod
+    def _run(self):
+        """Runs the stage with sys.stdin/stdout/stderr redirected, returns its exit code."""
@@ -1,9 +1,11 @@
 from .builtins import *
 from .proc import Process
+from .pycmd import Python_Process, is_command
 
 
 def create_proc(argv):
-    cmd = argv[0]
-    if 'builtin_{}'.format(cmd) in globals():
+    if argv[0] in BUILTINS:
         return Builtin_Process(argv)
+    if is_command(argv[0]):
+        return Python_Process(argv)
     return Process(argv)
@@ -0,0 +1,174 @@
+"""
+This module compiles PS1-style prompt templates into segment renderers.
+
+Supported escapes:
+  \\u user name    \\h short host name    \\H host name    \\$ '#' for root, else '$'
+  \\w cwd (~ for home)    \\W basename of cwd    \\j number of jobs
+  \\? last exit status    \\\\ backslash    ${NAME} any ANSI code name from ansi.py
+
+Segment values are cached. Static ones (user, host) are computed once and
+dynamic ones are recomputed only after invalidate() is called for them by
+the event that changes them: 'cwd' (cd), 'jobs' (job table) and 'status'
+(each command line). The shell loads this module only for a terminal and
+calls install(), which hooks the first two into the modules they come from.
+"""
+
+import os
+import re
+
+
+DEFAULT_TEMPLATE = r'${BRIGHT_GREEN}\u@\h:${BRIGHT_BLUE}\w${RESET}$ '
+
+_escape_re = re.compile(r'\\(.)')
+
+_cache = {}      # segment name -> rendered value
+_rendered = None # whole prompt, None when any segment was invalidated
+_template = None
+_segments = None # list of literal strings and segment names
+_status = 0
+
+
+def _user():
+    from .user import UserInfo
+    return UserInfo().name
+
+def _host():
+    return os.uname().nodename.split('.')[0]
+
+def _fqdn():
+    return os.uname().nodename
+
+def _cwd():
+    from .user import UserInfo
+    return UserInfo().subhomedir(os.getcwd())
+
+def _cwd_base():
+    cwd = _value('w')
+    return cwd if cwd in ('/', '~') else os.path.basename(cwd)
+
+def _jobs():
+    from .job import job_count
+    return str(job_count())
+
+def _last_status():
+    return str(_status)
+
+def _root():
+    return '#' if os.geteuid() == 0 else '$'
+
+
+# escape -> (renderer, event that invalidates it or None if static)
+SEGMENTS = {
+    'u': (_user, None),
+    'h': (_host, None),
+    'H': (_fqdn, None),
+    '$': (_root, None),
+    'w': (_cwd, 'cwd'),
+    'W': (_cwd_base, 'cwd'),
+    'j': (_jobs, 'jobs'),
+    '?': (_last_status, 'status'),
+}
+
+
+def compile_template(template):
+    from .ansi import PROMPT_MAP, map_string
+
+    segments = []
+    literal = []
+    pos = 0
+    for m in _escape_re.finditer(template):
+        literal.append(template[pos:m.start()])
+        pos = m.end()
+        escape = m.group(1)
+        if escape in SEGMENTS:
+            segments.append(map_string(''.join(literal), PROMPT_MAP))
+            segments.append(escape)
+            del literal[:]
+        else:
+            literal.append(escape if escape == '\\' else m.group(0))
+    literal.append(template[pos:])
+    segments.append(map_string(''.join(literal), PROMPT_MAP))
+    # literals sit at even indexes, segment names at odd ones
+    return segments
+
+def _value(name):
+    try:
+        return _cache[name]
+    except KeyError:
+        value = _cache[name] = SEGMENTS[name][0]()
+        return value
+
+def invalidate(event):
+    global _rendered
+
+    for name, (func, ev) in SEGMENTS.items():
+        if ev == event:
+            _cache.pop(name, None)
+    _rendered = None
+
+def install():
+    from . import builtins, job
+
+    builtins._cwd_hooks.append(lambda: invalidate('cwd'))
+    job._table_hooks.append(lambda: invalidate('jobs'))
+
+def set_status(status):
+    global _status
+
+    if status != _status:
+        _status = status
+        invalidate('status')
+
+def set_template(template):
+    global _template
+    global _segments
+    global _rendered
+
+    _template = template
+    _segments = compile_template(template)
+    _rendered = None
+
+def get_template():
+    return _template or DEFAULT_TEMPLATE
+
+def render():
+    global _rendered
+
+    if _rendered is None:
+        if _segments is None:
+            set_template(DEFAULT_TEMPLATE)
+        parts = list(_segments)
+        for i in range(1, len(parts), 2):
+            parts[i] = _value(parts[i])
+        _rendered = ''.join(parts)
+    return _rendered
+
+
+if __name__ == '__main__':
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            _cache.clear()
+
+        def test_compile(self):
+            segments = compile_template(r'\u:\w \\ \x ${NOPE}${RESET}\$ ')
+            self.assertEqual(segments[1::2], ['u', 'w', '$'])
+            self.assertEqual(segments[4], ' \\ \\x ${NOPE}\x01\x1b[0m\x02')
+
+        def test_cached(self):
+            set_template(r'\w|\?')
+            cwd = os.getcwd()
+            try:
+                first = render()
+                os.chdir('/')
+                self.assertEqual(render(), first)
+                invalidate('cwd')
+                self.assertEqual(render(), '/|0')
+                set_status(3)
+                self.assertEqual(render(), '/|3')
+            finally:
+                os.chdir(cwd)
+                set_status(0)
+
+    unittest.main()
@@ -0,0 +1,201 @@
+"""
+Python functions as pipeline commands.
+
+A plugin module registers functions with the command decorator and is
+loaded with the pyimport builtin, e.g. from ~/.pyshrc:
+
+    pyimport ~/.pysh/json_stages.py
+
+    # ~/.pysh/json_stages.py
+    import json
+    from PySH.pycmd import command
+
+    @command()
+    def jfield(args, lines):
+        for line in lines:
+            yield str(json.loads(line)[args[0]]) + '\\n'
+
+after which 'curl -s ... | jfield name | sort' runs jfield in the shell on
+a worker thread, streaming between the pipes with no fork or exec.
+
+The function is called with the arguments (argv[1:]) and stdin as an
+iterator: of text lines in 'lines' mode, of byte chunks in 'bytes' mode. It
+either returns an iterable whose items are written to stdout, or writes to
+sys.stdout itself and returns an exit code (None for 0). In 'fd' mode it is
+called with the raw stdin and stdout fds instead, so a stage that forwards
+data can use pipeio.copy_fd() and never copy it through user space:
+
+    @command(mode='fd')
+    def meter(args, infd, outfd):
+        print(copy_fd(infd, outfd), 'bytes', file=sys.stderr)
+"""
+
+from .proc import Thread_Process
+
+import os
+import sys
+
+
+CHUNK_SIZE = 65536
+
+_commands = {}  # name -> Python_Command
+
+
+class Python_Command:
+    __slots__ = ('name', 'func', 'mode')
+
+    def __init__(self, name, func, mode):
+        self.name = name
+        self.func = func
+        self.mode = mode
+
+
+def command(name=None, mode='lines'):
+    """Decorator registering func as the command name (default: its own name)."""
+
+    if mode not in ('lines', 'bytes', 'fd'):
+        raise ValueError('mode must be lines, bytes or fd')
+
+    def register(func):
+        _commands[name or func.__name__] = Python_Command(name or func.__name__, func, mode)
+        return func
+    return register
+
+def unregister(name):
+    _commands.pop(name, None)
+
+def commands():
+    return sorted(_commands)
+
+def is_command(name):
+    return name in _commands
+
+def load(target):
+    """
+    Imports a plugin, either a module name or the path of a .py file, so
+    its commands get registered.
+    """
+
+    import importlib
+
+    if target.endswith('.py') or os.sep in target:
+        import importlib.util
+
+        path = os.path.abspath(os.path.expanduser(target))
+        modname = 'pysh_plugin_' + os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(modname, path)
+        if spec is None:
+            raise RuntimeError('{}: not a Python file'.format(target))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[modname] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[modname]
+            raise
+        return module
+    return importlib.import_module(target)
+
+
+def _chunks(f):
+    read = f.read1
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+class Python_Process(Thread_Process):
+    __slots__ = ()
+
+    def _run(self):
+        cmd = _commands[self.argv[0]]
+        if cmd.mode == 'fd':
+            sys.stdout.flush()
+            return cmd.func(self.argv[1:], sys.stdin.fileno(), sys.stdout.fileno())
+        if cmd.mode == 'bytes':
+            sys.stdout.flush()
+            stdin = _chunks(sys.stdin.buffer)
+            stdout = sys.stdout.buffer
+        else:
+            stdin = iter(sys.stdin)
+            stdout = sys.stdout
+
+        result = cmd.func(self.argv[1:], stdin)
+        if result is None or isinstance(result, int):
+            return result
+        write = stdout.write
+        for item in result:
+            write(item)
+        return 0
+
+
+if __name__ == '__main__':
+    import unittest
+
+    from .job import Job, add_job, remove_job
+    from .pipeio import copy_fd
+    from .proc import Process
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            @command()
+            def upper(args, lines):
+                for line in lines:
+                    yield line.upper()
+
+            @command('count-bytes', mode='bytes')
+            def count_bytes(args, chunks):
+                print(sum(len(chunk) for chunk in chunks))
+                return int(args[0])
+
+            @command(mode='fd')
+            def relay(args, infd, outfd):
+                copy_fd(infd, outfd)
+
+            @command()
+            def bail(args, lines):
+                sys.exit(args[0] if args else None)
+
+        def tearDown(self):
+            unregister('upper')
+            unregister('count-bytes')
+            unregister('relay')
+            unregister('bail')
+
+        def run_job(self, *argvs):
+            rfd, wfd = os.pipe()
+            job = Job('test')
+            job.stdout = wfd
+            for argv in argvs:
+                job.add_proc(Python_Process(argv) if is_command(argv[0]) else Process(argv))
+            add_job(job)
+            job.launch()
+            remove_job(job)
+            os.close(wfd)
+            with open(rfd) as f:
+                return f.read(), job.returncode
+
+        def test_lines(self):
+            self.assertEqual(self.run_job(['printf', 'a\\nb\\n'], ['upper'], ['upper']), ('A\nB\n', 0))
+
+        def test_bytes(self):
+            self.assertEqual(self.run_job(['head', '-c', '200000', '/dev/zero'], ['count-bytes', '4']),
+                             ('200000\n', 4))
+
+        def test_fd(self):
+            self.assertEqual(self.run_job(['head', '-c', '300000', '/dev/zero'], ['relay'], ['wc', '-c']),
+                             ('300000\n', 0))
+
+        def test_exit(self):
+            # sys.exit() in a command only ends its stage
+            self.assertEqual(self.run_job(['printf', 'a'], ['bail'], ['upper']), ('', 0))
+            self.assertEqual(self.run_job(['printf', 'a'], ['upper'], ['bail', 3]), ('', 3))
+            self.assertEqual(self.run_job(['bail']), ('', 0))
+
+        def test_registry(self):
+            self.assertIn('upper', commands())
+            self.assertRaises(ValueError, command, mode='records')
+
+    unittest.main()
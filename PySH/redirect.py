@@ -0,0 +1,162 @@
+"""
+I/O redirections.
+
+Files are opened once, in the shell, with O_CLOEXEC, and each command gets
+a map of child fd -> shell fd that the spawn path installs as dup2 file
+actions and the fork path applies in one batch. The shell closes its copies
+right after the launch, so nothing stays open across commands.
+"""
+
+import os
+
+
+_open_flags = {
+    '<': os.O_RDONLY,
+    '>': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    '>>': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+
+def _open(filename, kind):
+    return os.open(filename, _open_flags[kind] | os.O_CLOEXEC, 0o666)
+
+def open_redirects(redirects, fds):
+    """
+    Applies redirects, a list of (fd, kind, target) in command line order,
+    to fds (child fd -> shell fd, None when closed), opening files as needed.
+    Returns the fds it opened, for the caller to close after the launch. On
+    error those are closed and OSError is raised with the filename set.
+    """
+
+    opened = []
+    target = None
+    try:
+        for fd, kind, target in redirects:
+            if kind != '>&':
+                fds[fd] = _open(target, kind)
+                opened.append(fds[fd])
+            elif target == '-':
+                fds[fd] = None
+            elif target.isdigit():
+                source = int(target)
+                if source in fds:
+                    source = fds[source]
+                else:
+                    os.fstat(source) # a shell fd, it must be open
+                if source is None:
+                    raise OSError(9, os.strerror(9), target) # EBADF
+                fds[fd] = source
+            else:
+                # >&file sends both stdout and stderr to file (fd is 1,
+                # expand_redirects() rejects any other)
+                fds[1] = fds[2] = _open(target, '>')
+                opened.append(fds[1])
+
+        # a source that is also a target would be overwritten by an earlier
+        # dup2 in the child (think 3>&1 1>&2 2>&3), so move it out of the way
+        targets = set(fds)
+        for fd in targets:
+            source = fds[fd]
+            while source is not None and source != fd and source in targets:
+                source = os.dup(source)
+                opened.append(source)
+            fds[fd] = source
+    except OSError as e:
+        close_fds(opened)
+        if e.filename is None:
+            e.filename = target
+        raise
+    return opened
+
+def close_fds(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import unittest
+
+    from .job import jobs, remove_job
+
+    # run without job control
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.cwd = os.getcwd()
+            os.chdir(self.tmp.name)
+
+        def tearDown(self):
+            os.chdir(self.cwd)
+            self.tmp.cleanup()
+
+        def read(self, name):
+            with open(name) as f:
+                return f.read()
+
+        def run_cmdline(self, cmdline):
+            from .cmd import parse_command
+            return parse_command(cmdline).run()
+
+        def test_open(self):
+            fds = {0: 0, 1: 1, 2: 2}
+            opened = open_redirects([(1, '>', 'out'), (2, '>&', '1'), (3, '>&', '-')], fds)
+            try:
+                self.assertEqual(fds, {0: 0, 1: opened[0], 2: opened[0], 3: None})
+                self.assertFalse(os.get_inheritable(opened[0]))
+            finally:
+                close_fds(opened)
+
+        def test_swap(self):
+            fds = {0: 0, 1: 1, 2: 2}
+            opened = open_redirects([(3, '>&', '1'), (1, '>&', '2'), (2, '>&', '3')], fds)
+            try:
+                # each source is a fresh fd, not one of the targets
+                self.assertEqual(len(opened), 3)
+                self.assertFalse(set(fd for target, fd in fds.items() if fd != target) & set(fds))
+            finally:
+                close_fds(opened)
+
+        def test_errors(self):
+            fds = {0: 0, 1: 1, 2: 2}
+            with self.assertRaises(OSError) as cm:
+                open_redirects([(1, '>', 'out'), (0, '<', 'missing')], fds)
+            self.assertEqual(cm.exception.filename, 'missing')
+            self.assertRaises(OSError, open_redirects, [(1, '>&', '97')], fds)
+
+        def test_commands(self):
+            self.run_cmdline('echo a > out; echo b >> out; cat < out > copy 2>&1')
+            self.assertEqual(self.read('copy'), 'a\nb\n')
+            self.run_cmdline('ls missing > out 2>&1')
+            self.assertIn('missing', self.read('out'))
+            self.run_cmdline('sh -c "echo out; echo err >&2" > o 2> e 3>&1 1>&2 2>&3')
+            self.assertEqual((self.read('o'), self.read('e')), ('err\n', 'out\n'))
+            # finished foreground jobs are gone from the table
+            self.run_cmdline('sleep 0.1 & jobs > builtin')
+            self.assertEqual(self.read('builtin').split()[1:], ['Running', 'sleep', '0.1'])
+            for job in jobs():
+                job.wait()
+                remove_job(job)
+            self.assertEqual(self.run_cmdline('cat < missing'), 1)
+            # >&file is both stdout and stderr, with another fd it is an error
+            self.run_cmdline('sh -c "echo out; echo err >&2" >&both')
+            self.assertEqual(sorted(self.read('both').split()), ['err', 'out'])
+            self.assertEqual(self.run_cmdline('echo a 2>&err'), 1)
+            self.assertFalse(os.path.exists('err'))
+
+        def test_fd_leak(self):
+            before = sorted(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+            if before is None:
+                self.skipTest('no /proc/self/fd')
+            for i in range(300):
+                self.run_cmdline('echo {0} > f{1}; cat < f{1} | cat >> all 2>&1; cat < missing; jobs > j'.format(i, i % 5))
+            self.assertEqual(sorted(os.listdir('/proc/self/fd')), before)
+            self.assertEqual(len(self.read('all').split()), 300)
+
+    unittest.main()
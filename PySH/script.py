@@ -0,0 +1,153 @@
+"""
+Whole-file script parsing with an on-disk parse cache.
+
+A script is parsed once into a Complete_Command. The result is pickled into
+$XDG_CACHE_HOME/pysh (~/.cache/pysh), keyed by the script's path, mtime and
+size plus the parser table signature, much like .pyc files, so running an
+unchanged script again skips lexing and parsing entirely.
+"""
+
+from . import parser
+
+import os
+import pickle
+import zlib
+
+
+CACHE_VERSION = 1
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pysh')
+
+def _cache_file(path):
+    return os.path.join(cache_dir(), '{}-{:08x}.ast'.format(
+        os.path.basename(path), zlib.crc32(path.encode('utf-8', 'surrogateescape'))))
+
+def _read_cache(cachefile, key):
+    try:
+        with open(cachefile, 'rb') as f:
+            cached_key, ast = pickle.load(f)
+    except Exception:
+        return None
+    if cached_key != key:
+        return None
+    return ast
+
+def _write_cache(cachefile, key, ast):
+    tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        with open(tmpfile, 'wb') as f:
+            pickle.dump((key, ast), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cachefile)
+    except (OSError, pickle.PicklingError):
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+
+def load_script(path):
+    """
+    Returns the parsed Complete_Command for the script at path. Raises
+    SyntaxError for invalid scripts, which are never cached.
+    """
+
+    path = os.path.abspath(path)
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        key = (CACHE_VERSION, parser.signature, path, st.st_mtime_ns, st.st_size)
+        cachefile = _cache_file(path)
+        if parser.signature is not None:
+            ast = _read_cache(cachefile, key)
+            if ast is not None:
+                return ast
+        text = f.read().decode('utf-8', 'surrogateescape')
+
+    ast = parser.parse(text)
+    if parser.signature is not None:
+        _write_cache(cachefile, key, ast)
+    return ast
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def setUp(self):
+            self.tmp = tempfile.TemporaryDirectory()
+            self.saved = os.environ.get('XDG_CACHE_HOME')
+            os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp.name, 'cache')
+            self.script = os.path.join(self.tmp.name, 'test.sh')
+
+        def tearDown(self):
+            if self.saved is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = self.saved
+            self.tmp.cleanup()
+
+        def write(self, text):
+            with open(self.script, 'w') as f:
+                f.write(text)
+
+        def test_cached(self):
+            self.write('echo a\n\necho b | cat\n')
+            ast = load_script(self.script)
+            self.assertEqual(len(ast.cmdlist), 2)
+            self.assertEqual(len(os.listdir(cache_dir())), 1)
+
+            saved_parse = parser.parse
+            parser.parse = None # must not be called
+            try:
+                cached = load_script(self.script)
+            finally:
+                parser.parse = saved_parse
+            self.assertEqual(repr(cached), repr(ast))
+
+        def test_changed(self):
+            self.write('echo a\n')
+            load_script(self.script)
+            self.write('echo a; echo b\n')
+            self.assertEqual(len(load_script(self.script).cmdlist), 2)
+
+        def run_pysh(self, *args):
+            import subprocess
+
+            pysh = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pysh')
+            env = dict(os.environ)
+            env.pop('PYTHONUNBUFFERED', None)
+            return subprocess.run([sys.executable, pysh] + list(args), stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+
+        def test_exit_status(self):
+            for text, status in (('exit 3\necho not reached\n', 3), ('false; exit\n', 1),
+                                 ('true\nexit 1\n', 1), ('false\n', 1), ('exit 3 | cat; exit\n', 0)):
+                self.write(text)
+                proc = self.run_pysh(self.script)
+                self.assertEqual((proc.returncode, proc.stdout), (status, b''), text)
+            self.assertEqual(self.run_pysh('-c', 'exit 300').returncode, 44)
+
+        def test_builtin_output_order(self):
+            # stdout is a pipe, so the shell's own output is block buffered
+            proc = self.run_pysh('-c', 'pipesize; echo x; pipesize; echo y')
+            self.assertEqual(proc.stdout, b'default\nx\ndefault\ny\n')
+
+        def test_startup_profile(self):
+            self.write('true\n')
+            for args in (('-c', 'true'), (self.script,)):
+                report = self.run_pysh('--startup-profile', *args).stderr
+                self.assertIn(b'startup: ', report)
+                # only needed for a terminal
+                self.assertNotIn(b'PySH.prompt', report)
+                self.assertNotIn(b'readline', report)
+
+        def test_syntax_error(self):
+            self.write('echo a |\n')
+            self.assertRaises(SyntaxError, load_script, self.script)
+            self.assertFalse(os.path.exists(cache_dir()))
+
+    unittest.main()
@@ -1,85 +1,199 @@
-from .ansi import *
-from .builtins import _flags
-from .cmd import parse_command
+from . import startup
+from .builtins import Exit, _flags
+from .cmd import Command_List, parse_command, set_positional
 from .job import *
 from .signals import *
 from .term import Terminal
-from .user import UserInfo
 
 import os
-import readline
-import socket
-import traceback
+import sys
 
 
 _terminal = Terminal()
 
 
 class Shell:
-    def __init__(self):
-        self.__inputrc = os.path.join(os.path.expanduser('~'), '.inputrc')
-        self.__histfile = os.path.join(os.path.expanduser('~'), '.pysh-history')
+    def __init__(self, interactive=True):
+        if not interactive:
+            _terminal.disable_job_control()
 
-        if os.path.exists(self.__inputrc):
-            readline.read_init_file(self.__inputrc)
-        if os.path.exists(self.__histfile):
-            readline.read_history_file(self.__histfile)
+        self.__history = None
+        self.__readline = None
+        self.__prompt = None
+        self.__reading = False # a line, at the prompt
 
         self.__children = []
+        self.status = 0
 
         self.__pid = os.getpid()
 
         if _terminal.interactive:
-            _terminal.loop_until_foreground(os.getpgrp())
-            ignore_signals()
-            os.setpgid(self.__pid, self.__pid)
-            _terminal.grab_control(self.__pid)
-            _terminal.save_attributes()
+            # readline and the prompt code are only loaded for a terminal,
+            # input() picks up line editing once readline is imported
+            with startup.step('readline'):
+                import readline
+                self.__readline = readline
+                inputrc = os.path.join(os.path.expanduser('~'), '.inputrc')
+                if os.path.exists(inputrc):
+                    readline.read_init_file(inputrc)
+
+            with startup.step('prompt'):
+                from . import prompt
+                prompt.install()
+                self.__prompt = prompt
+
+            with startup.step('completion'):
+                from . import complete
+                complete.install(readline)
+
+            with startup.step('history'):
+                from .history import History
+
+                # only the recent tail, the rest is for history search
+                self.__history = History()
+                try:
+                    for number, stamp, line in self.__history.tail():
+                        readline.add_history(line)
+                except OSError as e:
+                    print('pysh: history: {}'.format(e.strerror), file=sys.stderr)
+
+            with startup.step('terminal'):
+                _terminal.loop_until_foreground(os.getpgrp())
+                ignore_signals()
+                os.setpgid(self.__pid, self.__pid)
+                _terminal.grab_control(self.__pid)
+                _terminal.save_attributes()
 
         _terminal.shell_pgid = os.getpgid(self.__pid)
 
+        with startup.step('reaper'):
+            install_reaper()
+
     def __enter__(self):
         return self
 
     def __exit__(self, exctype, excval, tb):
-        readline.write_history_file(self.__histfile)
+        pass
 
     def _prompt(self):
-        info = UserInfo()
-        ident = '{}{}@{}'.format(PROMPT_BRIGHT_GREEN, info.name, socket.gethostname())
-        cwd = '{}{}{}'.format(PROMPT_BRIGHT_BLUE, info.subhomedir(os.getcwd()), PROMPT_RESET)
-        return '{}:{}$ '.format(ident, cwd)
+        if not _terminal.interactive:
+            return ''
+
+        self.__prompt.set_status(self.status)
+        return self.__prompt.render()
 
     def _dump_traceback(self):
         if _flags.get('tracebacks', False):
+            import traceback
+
             print('Traceback:', file=sys.stderr)
             exctype, excval, tb = sys.exc_info()
             traceback.print_tb(tb)
 
+    def _remember(self, line):
+        # appended right away, so other shells see it and nothing is lost
+        # if this one is killed
+        if self.__history is not None and line.strip():
+            try:
+                self.__history.append(line)
+            except OSError as e:
+                print('pysh: history: {}'.format(e.strerror), file=sys.stderr)
+
     def run_cmd(self, cmd):
         try:
-            cmd = parse_command(os.path.expandvars(cmd.strip()))
-            cmd.run()
+            cmd = parse_command(cmd.strip())
+            self.status = cmd.run()
+        except SyntaxError as e:
+            print('pysh: {}'.format(e), file=sys.stderr)
+            self.status = 2
+        except Exit as e:
+            self.status = e.status
+            return False
+        except EOFError:
+            return False
+        return True
+
+    def _run_ast(self, name, load):
+        try:
+            ast = load()
+        except SyntaxError as e:
+            print('pysh: {}: {}'.format(name, e), file=sys.stderr)
+            self.status = 2
+            return True
+        except OSError as e:
+            print('pysh: {}: {}'.format(name, e.strerror), file=sys.stderr)
+            self.status = 127
+            return True
+        try:
+            self.status = Command_List(ast).run()
+        except Exit as e:
+            self.status = e.status
+            return False
         except EOFError:
             return False
         return True
 
     def run_file(self, filename):
-        with open(filename) as f:
-            for line in f:
-                self.run_cmd(line)
+        from .script import load_script
 
-    def run_interactive(self):
+        return self._run_ast(filename, lambda: load_script(filename))
+
+    def run_script(self, filename, args=()):
+        startup.report() # the shell is ready, the rest is the script's
+        set_positional([filename] + list(args))
+        self.run_file(filename)
+        return self.status
+
+    def run_string(self, text, args=()):
+        from .parser import parse
+
+        startup.report()
+        set_positional(list(args) or ['pysh'])
+        self._run_ast('-c', lambda: parse(text))
+        return self.status
+
+    def _run_pyshrc(self):
         pyshrc = os.path.expanduser('~/.pyshrc')
         if os.path.exists(pyshrc):
-            self.run_file(pyshrc)
+            with startup.step('pyshrc'):
+                self.run_file(pyshrc)
+        with startup.step('first prompt'):
+            self._prompt()
+        startup.report()
 
+    def run_interactive(self):
+        # the handler runs on this thread, also while input() waits
+        install_reaper(self._notify_at_prompt)
+        self._run_pyshrc()
+        return self._read_loop(self._read_line)
+
+    def run_async(self):
+        """
+        Like run_interactive, but while a line is read an asyncio event loop
+        reaps children on another thread, so background jobs can be awaited.
+        The line is still read on this thread, where ^C interrupts it.
+        """
+
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        install_async_reaper(loop, self._notify_at_prompt)
+        self._run_pyshrc()
+        try:
+            return self._read_loop(lambda: self._read_line_async(loop))
+        finally:
+            loop.close()
+
+    def _read_loop(self, read_line):
         running = True
 
         while running:
             try:
                 notify()
-                running = self.run_cmd(input(self._prompt()))
+                line = read_line()
+                self._remember(line)
+                running = self.run_cmd(line)
             except KeyboardInterrupt:
                 if _terminal.interactive:
                     print('^C')
@@ -87,3 +201,35 @@ class Shell:
                 print('exit')
                 return False
 
+    def _read_line(self):
+        self.__reading = True
+        try:
+            return input(self._prompt())
+        finally:
+            self.__reading = False
+
+    def _read_line_async(self, loop):
+        import threading
+
+        def run_loop():
+            # ^C is for the line being read on the main thread
+            pthread_sigmask(SIG_BLOCK, (SIGINT,))
+            loop.run_forever()
+
+        thread = threading.Thread(target=run_loop, name='asyncio', daemon=True)
+        thread.start()
+        try:
+            return self._read_line()
+        finally:
+            # commands run with the loop stopped, as they change the job table
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+    def _notify_at_prompt(self):
+        # 'set enable notify': report changes as they happen, not only
+        # before the next prompt, then redraw the prompt and pending input
+        if self.__reading and _flags.get('notify', False) and pending_notices():
+            print()
+            notify()
+            if self.__readline is not None:
+                print(self._prompt() + self.__readline.get_line_buffer(), end='', flush=True)
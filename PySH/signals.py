@@ -2,9 +2,11 @@ from signal import *
 
 _saved = {}
 
+JOB_CONTROL_SIGNALS = (SIGINT, SIGQUIT, SIGTSTP, SIGTTIN, SIGTTOU, SIGCHLD)
+
 
 def default_signals():
-    for i in (SIGINT, SIGQUIT, SIGTSTP, SIGTTIN, SIGTTOU, SIGCHLD):
+    for i in JOB_CONTROL_SIGNALS + (SIGPIPE,):
         _saved[i] = signal(i, SIG_DFL)
 
 def ignore_signals():
@@ -0,0 +1,129 @@
+"""
+Startup profiler, enabled with pysh --startup-profile
+
+Times every module import (cumulative and self time, like python -X
+importtime) and every named init step, and prints a report to stderr once
+the shell is ready. When disabled, step() costs a single global lookup.
+"""
+
+import sys
+import time
+
+
+_profile = None
+
+
+class _Null_Step:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excval, tb):
+        return False
+
+_null_step = _Null_Step()
+
+
+class _Step:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exctype, excval, tb):
+        _profile.steps.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class _Import_Timer:
+    """
+    Meta path finder that wraps the loader of every module found by the
+    remaining finders, timing its exec_module().
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.stack = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _Timed_Loader(self, spec.loader)
+                return spec
+        return None
+
+
+class _Timed_Loader:
+    def __init__(self, timer, loader):
+        self.timer = timer
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self.timer.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            self.timer.profile.imports.append((module.__name__, total - children, total, len(stack)))
+
+
+class _Profile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports = []
+        self.steps = []
+        self.timer = _Import_Timer(self)
+        sys.meta_path.insert(0, self.timer)
+
+
+def enable():
+    global _profile
+
+    if _profile is None:
+        _profile = _Profile()
+
+def step(name):
+    if _profile is None:
+        return _null_step
+    return _Step(name)
+
+def report(file=None):
+    """
+    Prints the collected profile and disables profiling; later imports are
+    not part of startup.
+    """
+
+    global _profile
+
+    if _profile is None:
+        return
+    profile = _profile
+    _profile = None
+    sys.meta_path.remove(profile.timer)
+
+    if file is None:
+        file = sys.stderr
+    total = time.perf_counter() - profile.start
+    print('startup: {:.1f} ms total'.format(total * 1e3), file=file)
+    print('{:>9} {:>9}  import'.format('self ms', 'cumul ms'), file=file)
+    for name, own, cumulative, depth in profile.imports:
+        print('{:9.2f} {:9.2f}  {}{}'.format(own * 1e3, cumulative * 1e3, '  ' * depth, name), file=file)
+    print('{:>9}  step'.format('ms'), file=file)
+    for name, secs in profile.steps:
+        print('{:9.2f}  {}'.format(secs * 1e3, name), file=file)
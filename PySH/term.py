@@ -16,10 +16,16 @@ class Terminal(Borg):
     def interactive(self):
         return self.__interactive
 
+    def disable_job_control(self):
+        self.__interactive = False
+
     def loop_until_foreground(self, pgid):
         while os.tcgetpgrp(self.__fd) != pgid:
             os.kill(-pgid, signal.SIGTTIN)
 
+    def foreground_pgid(self):
+        return os.tcgetpgrp(self.__fd)
+
     def grab_control(self, pgid):
         os.tcsetpgrp(self.__fd, pgid)
 
@@ -0,0 +1,79 @@
+"""
+Per-thread standard streams for pipeline stages that run in the shell
+process on worker threads.
+
+install() replaces sys.stdin, sys.stdout and sys.stderr with proxies that
+forward to the real streams, except in a thread that has entered redirect(),
+where they forward to that stage's pipe files instead. print() and friends
+in builtins then need no changes to write into a pipeline.
+"""
+
+import contextlib
+import sys
+import threading
+
+
+_local = threading.local()
+
+
+class _Stream:
+    __slots__ = ('_name', '_default')
+
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def _current(self):
+        return getattr(_local, self._name, None) or self._default
+
+    def __getattr__(self, attr):
+        return getattr(self._current(), attr)
+
+    def __iter__(self):
+        return iter(self._current())
+
+
+def install():
+    for name in ('stdin', 'stdout', 'stderr'):
+        stream = getattr(sys, name)
+        if not isinstance(stream, _Stream):
+            setattr(sys, name, _Stream(name, stream))
+
+@contextlib.contextmanager
+def redirect(stdin, stdout, stderr):
+    _local.stdin = stdin
+    _local.stdout = stdout
+    _local.stderr = stderr
+    try:
+        yield
+    finally:
+        del _local.stdin, _local.stdout, _local.stderr
+
+
+if __name__ == '__main__':
+    import io
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        def test_redirect(self):
+            install()
+            install()
+            self.assertIsInstance(sys.stdout, _Stream)
+            self.assertNotIsInstance(sys.stdout._default, _Stream)
+
+            out = {}
+            def stage(name):
+                buf = io.StringIO()
+                with redirect(io.StringIO('in\n'), buf, buf):
+                    print(name, sys.stdin.readline().strip())
+                out[name] = buf.getvalue()
+
+            threads = [threading.Thread(target=stage, args=(str(i),)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(out, dict((str(i), '{} in\n'.format(i)) for i in range(8)))
+            self.assertIs(sys.stdout._current(), sys.stdout._default)
+
+    unittest.main()
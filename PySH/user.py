@@ -12,6 +12,8 @@ class UserInfo(Borg):
         return self
 
     def __init__(self):
+        if hasattr(self, '_UserInfo__uid'):
+            return
         self.__uid = os.geteuid()
         try:
             info = pwd.getpwuid(self.__uid)
@@ -0,0 +1,9 @@
+def no_job_control():
+    """
+    Benchmarks never run with job control, also when started from a
+    terminal. Called first by the run() of each one that starts processes.
+    """
+
+    from PySH.term import Terminal
+
+    Terminal().disable_job_control()
@@ -0,0 +1,32 @@
+"""
+ANSI markup micro-benchmark: map_string versus string.Template
+
+Usage: python3 -m bench.ansi [iterations]
+"""
+
+import string
+import sys
+import timeit
+
+from PySH.ansi import ANSI_MAP, DEFAULT_MAP, map_string, strip_markup
+
+
+TEMPLATE = '[1]\t${GREEN}Done${RESET}\t\t${BOLD_ON}make${BOLD_OFF} -j8 ${BRIGHT_BLUE}all${RESET}'
+
+
+def run(iterations=100000):
+    cases = {
+        'template/ansi': lambda: string.Template(TEMPLATE).safe_substitute(ANSI_MAP),
+        'template/plain': lambda: string.Template(TEMPLATE).safe_substitute(DEFAULT_MAP),
+        'map_string/ansi': lambda: map_string(TEMPLATE, ANSI_MAP),
+        'map_string/plain': lambda: map_string(TEMPLATE, DEFAULT_MAP),
+        'strip_markup': lambda: strip_markup(TEMPLATE),
+    }
+    return dict((name, min(timeit.repeat(func, number=iterations, repeat=3)) / iterations)
+                for name, func in cases.items())
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<18} {:8.3f} us'.format(name, secs * 1e6))
@@ -0,0 +1,43 @@
+"""
+Word expansion: glob.glob per word versus the cached pathglob engine
+
+Usage: python3 -m bench.expand [iterations]
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import timeit
+
+from PySH import pathglob
+from PySH.cmd import expand_word
+
+
+WORDS = ['-v', '--color=auto', 'foo', 'bar.txt', '*.py', 'sub/*.c', 'x{1,2,3}.o']
+
+
+def run(iterations=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            os.mkdir('sub')
+            for i in range(200):
+                open('f{}.py'.format(i), 'w').close()
+                open('sub/f{}.c'.format(i), 'w').close()
+            cases = {
+                'glob.glob': lambda: [glob.glob(w) for w in WORDS],
+                'expand_word': lambda: [expand_word(w) for w in WORDS],
+                'expand_word/cold': lambda: (pathglob.clear_cache(), [expand_word(w) for w in WORDS]),
+            }
+            return dict((name, min(timeit.repeat(func, number=iterations, repeat=3)) / iterations)
+                        for name, func in cases.items())
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<18} {:8.1f} us'.format(name, secs * 1e6))
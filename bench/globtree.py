@@ -0,0 +1,58 @@
+"""
+Glob expansion on a synthetic tree: one directory level, several levels,
+and ** with the parallel walker, each warm (cached listings) and cold
+
+Usage: python3 -m bench.globtree [iterations]
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+from PySH import pathglob
+
+
+PATTERNS = {
+    'flat': 'src/*.py',
+    'nested': 'src/*/*/*.c',
+    'globstar': 'src/**/*.h',
+}
+
+
+def make_tree(root, fanout=8, depth=3, files=20):
+    """Creates fanout ** depth directories under root/src with files of each kind."""
+
+    dirs = [os.path.join(root, 'src')]
+    for level in range(depth + 1):
+        below = []
+        for d in dirs:
+            os.mkdir(d)
+            for i in range(files):
+                for ext in ('py', 'c', 'h'):
+                    open(os.path.join(d, 'f{}.{}'.format(i, ext)), 'w').close()
+            if level < depth:
+                below.extend(os.path.join(d, 'd{}'.format(i)) for i in range(fanout))
+        dirs = below
+
+def run(iterations=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        make_tree(tmp)
+        os.chdir(tmp)
+        try:
+            results = {}
+            for name, pattern in PATTERNS.items():
+                warm = lambda: pathglob.glob(pattern)
+                cold = lambda: (pathglob.clear_cache(), pathglob.glob(pattern))
+                for label, func in ((name, warm), (name + '/cold', cold)):
+                    results[label] = min(timeit.repeat(func, number=iterations, repeat=3)) / iterations
+            return results
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<18} {:10.1f} us'.format(name, secs * 1e6))
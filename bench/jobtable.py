@@ -0,0 +1,68 @@
+"""
+Job table operations with thousands of jobs: add, lookup by id, pgid and
+pid, status updates through the reaped queue, and removal
+
+Usage: python3 -m bench.jobtable [jobs]
+"""
+
+import sys
+import time
+
+from . import no_job_control
+from PySH import job as jobmod
+from PySH.proc import Process, exit_status
+
+
+PID_BASE = 1 << 22 # above pid_max, so no real child is ever looked up
+
+
+def make_jobs(count, stages=3):
+    jobs = []
+    for i in range(count):
+        job = jobmod.Job('stage | stage | stage')
+        for n in range(stages):
+            proc = Process(['stage'])
+            proc.pid = PID_BASE + i * stages + n
+            job.add_proc(proc)
+        job.pgid = job.procs[0].pid
+        jobs.append(job)
+    return jobs
+
+def run(count=5000):
+    no_job_control()
+    jobs = make_jobs(count)
+    results = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        func()
+        results[name] = (time.perf_counter() - start) / count
+
+    timed('add_job', lambda: [jobmod.add_job(job) for job in jobs])
+    timed('find_job', lambda: [jobmod.find_job(job_id=job.job_id) for job in jobs])
+    timed('find_pgid', lambda: [jobmod.find_job(pgid=job.pgid) for job in jobs])
+    timed('find_process', lambda: [jobmod.find_process(job.procs[-1].pid) for job in jobs])
+
+    def reap_all():
+        status = exit_status(0)
+        for job in jobs:
+            for proc in job.procs:
+                jobmod._reaped.append((proc.pid, status, None, None))
+        jobmod.update_status()
+    # update_status() would collect real children too when no reaper is set
+    installed = jobmod._reaper_installed
+    jobmod._reaper_installed = True
+    try:
+        timed('update_status', reap_all)
+    finally:
+        jobmod._reaper_installed = installed
+    timed('jobs_listing', lambda: [list(jobmod.jobs()) for i in range(10)])
+    timed('remove_job', lambda: [jobmod.remove_job(job) for job in jobs])
+    assert all(job.completed and jobmod.find_job(job_id=job.job_id) is not job for job in jobs)
+    return results
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<14} {:8.3f} us/job'.format(name, secs * 1e6))
@@ -0,0 +1,51 @@
+"""
+Pipeline throughput benchmark: pysh versus /bin/sh
+
+Usage: python3 -m bench.pipeline [megabytes] [stages]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from . import no_job_control
+from PySH.cmd import parse_command
+
+
+def pipeline_cmdline(megabytes, stages):
+    return ' | '.join(['head -c {}M /dev/zero'.format(megabytes)] +
+                      ['cat'] * stages + ['wc -c'])
+
+def time_pysh(cmdline):
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        start = time.perf_counter()
+        parse_command(cmdline).run()
+        return time.perf_counter() - start
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def time_sh(cmdline):
+    start = time.perf_counter()
+    subprocess.call(['/bin/sh', '-c', cmdline], stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def run(megabytes=256, stages=2, repeat=3):
+    no_job_control()
+    cmdline = pipeline_cmdline(megabytes, stages)
+    results = {}
+    for name, func in (('pysh', time_pysh), ('sh', time_sh)):
+        best = min(func(cmdline) for i in range(repeat))
+        results[name] = megabytes / 1024 / best
+    return results
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, gbps in run(*args).items():
+        print('{:<6} {:8.3f} GB/s'.format(name, gbps))
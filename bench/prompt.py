@@ -0,0 +1,46 @@
+"""
+Prompt render time: cached, after a status change, after a cd, and with
+the template recompiled every time
+
+Usage: python3 -m bench.prompt [iterations]
+"""
+
+import sys
+import timeit
+
+from PySH import prompt
+
+
+TEMPLATE = r'${GREEN}\u@\h${RESET}:${BRIGHT_BLUE}\w${RESET} [\j] \?\$ '
+
+
+def run(iterations=20000):
+    prompt.set_template(TEMPLATE)
+    status = [0]
+
+    def status_change():
+        status[0] ^= 1
+        prompt.set_status(status[0])
+        return prompt.render()
+
+    def cd():
+        prompt.invalidate('cwd')
+        return prompt.render()
+
+    cases = {
+        'cached': prompt.render,
+        'status': status_change,
+        'cwd': cd,
+        'template': lambda: (prompt.set_template(TEMPLATE), prompt.render()),
+    }
+    try:
+        return dict((name, min(timeit.repeat(func, number=iterations, repeat=3)) / iterations)
+                    for name, func in cases.items())
+    finally:
+        prompt.set_status(0)
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<10} {:8.3f} us'.format(name, secs * 1e6))
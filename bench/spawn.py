@@ -0,0 +1,44 @@
+"""
+Process launch latency benchmark: posix_spawn versus fork, by shell RSS
+
+Usage: python3 -m bench.spawn [iterations]
+"""
+
+import os
+import sys
+import time
+
+from . import no_job_control
+from PySH import proc
+
+
+RSS_SIZES_MB = (0, 256, 1024)
+
+
+def time_launch(iterations, spawn):
+    proc.use_spawn = spawn
+    start = time.perf_counter()
+    for i in range(iterations):
+        p = proc.Process(['true'])
+        pid = p.launch(0, {0: 0, 1: 1, 2: 2}, True)
+        os.waitpid(pid, 0)
+    return (time.perf_counter() - start) / iterations
+
+def run(iterations=200, sizes=RSS_SIZES_MB):
+    no_job_control()
+    results = {}
+    for rss in sizes:
+        ballast = bytearray(rss * 1024 * 1024)
+        for i in range(0, len(ballast), 4096): # fault the pages in
+            ballast[i] = 1
+        for name, spawn in (('spawn', True), ('fork', False)):
+            results['{}/{}M'.format(name, rss)] = time_launch(iterations, spawn)
+        del ballast
+    proc.use_spawn = hasattr(os, 'posix_spawn')
+    return results
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, secs in run(*args).items():
+        print('{:<12} {:8.1f} us'.format(name, secs * 1e6))
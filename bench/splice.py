@@ -0,0 +1,62 @@
+"""
+Three-stage pipeline throughput: the middle stage as an external cat, a
+Python stage copying through user space, and a Python stage forwarding with
+splice, each with the default and with 1 MiB pipes
+
+Usage: python3 -m bench.splice [megabytes]
+"""
+
+import os
+import sys
+import time
+
+from . import no_job_control
+from PySH import pipeio
+from PySH.cmd import parse_command
+from PySH.pycmd import command, unregister
+
+
+@command('bench-copy', mode='bytes')
+def bench_copy(args, chunks):
+    return chunks
+
+@command('bench-splice', mode='fd')
+def bench_splice(args, infd, outfd):
+    pipeio.copy_fd(infd, outfd)
+
+
+def time_pipeline(cmdline):
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        start = time.perf_counter()
+        parse_command(cmdline).run()
+        return time.perf_counter() - start
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def run(megabytes=1024, repeat=3):
+    no_job_control()
+    results = {}
+    try:
+        for size in (0, 1 << 20):
+            pipeio.PIPE_SIZE = size
+            for stage in ('cat', 'bench-copy', 'bench-splice'):
+                cmdline = 'head -c {}M /dev/zero | {} | wc -c'.format(megabytes, stage)
+                best = min(time_pipeline(cmdline) for i in range(repeat))
+                name = '{}/{}'.format(stage, '1M' if size else 'default')
+                results[name] = megabytes / 1024 / best
+    finally:
+        pipeio.PIPE_SIZE = 0
+        unregister('bench-copy')
+        unregister('bench-splice')
+    return results
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    for name, gbps in run(*args).items():
+        print('{:<22} {:8.3f} GB/s'.format(name, gbps))
@@ -0,0 +1,148 @@
+"""
+Runs the benchmarks, saves the results and compares them to a baseline
+
+Usage: python3 -m bench.suite [-q] [-o results.json] [-b baseline.json]
+                              [-t tolerance%] [--save-baseline | --no-compare]
+                              [benchmark ...]
+
+Each metric is stored with its unit, which says which direction is better:
+times (us) should go down, rates (MB/s, GB/s) up. A metric more than the
+tolerance (default 25%) worse than the baseline is reported as a
+REGRESSION on stderr and the suite exits with status 1, as it does when
+there is no baseline to compare with unless --no-compare is given.
+Baselines are per machine: record one with --save-baseline on a quiet
+system before making changes. Everything runs locally, on generated data.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS = os.path.join(BENCH_DIR, 'results.json')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+TOLERANCE = 25.0
+
+_HIGHER_IS_BETTER = ('MB/s', 'GB/s')
+
+
+def _us(results):
+    return dict((name, (secs * 1e6, 'us')) for name, secs in results.items())
+
+def _rate(unit):
+    return lambda results: dict((name, (value, unit)) for name, value in results.items())
+
+def _tokenizer(results):
+    return dict((name, (mbps, 'MB/s')) for name, (mbps, tps) in results.items())
+
+# name -> (kwargs, quick kwargs, results -> {metric: (value, unit)})
+BENCHMARKS = {
+    'tokenizer': ({'megabytes': 4}, {'megabytes': 0.5}, _tokenizer),
+    'expand': ({'iterations': 2000}, {'iterations': 200}, _us),
+    'globtree': ({'iterations': 20}, {'iterations': 3}, _us),
+    'spawn': ({'iterations': 200, 'sizes': (0, 256, 1024)}, {'iterations': 30, 'sizes': (0, 256)}, _us),
+    'pipeline': ({'megabytes': 256}, {'megabytes': 32}, _rate('GB/s')),
+    'splice': ({'megabytes': 1024}, {'megabytes': 64}, _rate('GB/s')),
+    'jobtable': ({'count': 5000}, {'count': 1000}, _us),
+    'prompt': ({'iterations': 20000}, {'iterations': 2000}, _us),
+    'ansi': ({'iterations': 100000}, {'iterations': 10000}, _us),
+}
+
+
+def run(names=None, quick=False, log=None):
+    """Runs the named benchmarks (default all), returns {'bench/metric': [value, unit]}."""
+
+    metrics = {}
+    for name in names or BENCHMARKS:
+        kwargs, quick_kwargs, convert = BENCHMARKS[name]
+        module = importlib.import_module('bench.' + name)
+        start = time.perf_counter()
+        results = module.run(**(quick_kwargs if quick else kwargs))
+        for metric, (value, unit) in convert(results).items():
+            metrics['{}/{}'.format(name, metric)] = [value, unit]
+        if log is not None:
+            print('{:<10} {:6.1f}s'.format(name, time.perf_counter() - start), file=log)
+    return metrics
+
+def compare(metrics, baseline, tolerance=TOLERANCE):
+    """
+    Returns [(metric, value, unit, baseline value, change %, regressed)]
+    for the metrics in both; change is positive when better.
+    """
+
+    rows = []
+    for metric, (value, unit) in sorted(metrics.items()):
+        if metric not in baseline:
+            continue
+        base, base_unit = baseline[metric]
+        if base_unit != unit or not base or not value:
+            continue
+        if unit in _HIGHER_IS_BETTER:
+            change = (value / base - 1) * 100
+        else:
+            change = (base / value - 1) * 100
+        rows.append((metric, value, unit, base, change, change < -tolerance))
+    return rows
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['metrics']
+
+def save(path, metrics):
+    with open(path, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                   'machine': platform.platform(), 'cpus': os.cpu_count(), 'metrics': metrics},
+                  f, indent=1, sort_keys=True)
+        f.write('\n')
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python3 -m bench.suite')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='of {} (default all)'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('-q', '--quick', action='store_true', help='smaller inputs, noisier results')
+    parser.add_argument('-o', '--output', default=RESULTS)
+    parser.add_argument('-b', '--baseline', default=BASELINE)
+    parser.add_argument('-t', '--tolerance', type=float, default=TOLERANCE, help='in percent')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save-baseline', action='store_true')
+    mode.add_argument('--no-compare', action='store_true', help='only print and save the results')
+    opts = parser.parse_args(args)
+    unknown = [name for name in opts.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark: {}'.format(', '.join(unknown)))
+
+    metrics = run(opts.benchmarks, opts.quick, log=sys.stderr)
+    save(opts.output, metrics)
+    if opts.save_baseline:
+        save(opts.baseline, metrics)
+        print('baseline saved to {}'.format(opts.baseline))
+        return 0
+
+    if opts.no_compare or not os.path.exists(opts.baseline):
+        for metric, (value, unit) in sorted(metrics.items()):
+            print('{:<28} {:12.3f} {}'.format(metric, value, unit))
+        if opts.no_compare:
+            return 0
+        print('no baseline at {}, record one with --save-baseline or run with --no-compare'.format(
+            opts.baseline), file=sys.stderr)
+        return 1
+
+    rows = compare(metrics, load(opts.baseline), opts.tolerance)
+    print('{:<28} {:>12} {:>12} {:>8}'.format('metric', 'now', 'baseline', 'change'))
+    for metric, value, unit, base, change, regressed in rows:
+        print('{:<28} {:12.3f} {:12.3f} {:+7.1f}%  {}{}'.format(
+            metric, value, base, change, unit, '  REGRESSION' if regressed else ''))
+    regressions = [row for row in rows if row[-1]]
+    for metric, value, unit, base, change, regressed in regressions:
+        print('REGRESSION: {} {:.3f} {} vs {:.3f} {} baseline ({:.1f}% worse, tolerance {}%)'.format(
+            metric, value, unit, base, unit, -change, opts.tolerance), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
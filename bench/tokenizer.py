@@ -0,0 +1,56 @@
+"""
+Tokenizer and parser throughput on generated scripts
+
+Usage: python3 -m bench.tokenizer [megabytes]
+"""
+
+import random
+import sys
+import time
+
+from PySH.parser import Lexer, parse
+
+
+LINES = [
+    'ls -l /usr/bin | grep -v "^total" > /tmp/out 2>&1',
+    "echo 'single quoted $HOME' \"double $USER\" plain$PATH",
+    'make -j8 all && echo done || echo failed',
+    'cd /tmp; sleep 1 & echo started',
+    'cat a"b c"d\\ e *.txt  # trailing comment',
+    'find . -name "*.py" | xargs wc -l | sort -n | tail -5',
+    '',
+]
+
+
+def generate(size):
+    rng = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = rng.choice(LINES)
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+
+def run(megabytes=4):
+    text = generate(int(megabytes * 1024 * 1024))
+    results = {}
+
+    start = time.perf_counter()
+    ntokens = sum(1 for tok in Lexer().tokenize(text))
+    elapsed = time.perf_counter() - start
+    results['tokenize'] = (len(text) / elapsed / 1e6, ntokens / elapsed)
+
+    start = time.perf_counter()
+    parse(text)
+    elapsed = time.perf_counter() - start
+    results['parse'] = (len(text) / elapsed / 1e6, ntokens / elapsed)
+
+    return results
+
+
+if __name__ == '__main__':
+    args = [float(x) for x in sys.argv[1:]]
+    for name, (mbps, tps) in run(*args).items():
+        print('{:<10} {:8.2f} MB/s {:12.0f} tokens/s'.format(name, mbps, tps))